@@ -0,0 +1,73 @@
+"""Асинхронные обёртки над вьюсетами для запуска под ASGI.
+
+DRF и ORM Django 3.2 синхронные, поэтому обёртка выполняет обычную
+вьюху(включая рендеринг ответа) в отдельном пуле потоков размером
+«ASGI_THREADS» через «sync_to_async(thread_sensitive=False)». Пока поток
+ждёт БД, цикл событий продолжает принимать соединения и читать тела
+медленных клиентов. Подключаются в «api.urls» при «ASYNC_VIEWS».
+
+Остальные вьюхи остаются синхронными: под ASGI Django выполняет их в
+одном общем потоке воркера, то есть по очереди. То же происходит со всеми
+запросами, если в цепочке есть синхронные middleware
+(«ProfilingMiddleware», «ReplicaRoutingMiddleware»).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .connections import close_unusable_connections
+from .profiling import current_profile, profiled_connections
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.ASGI_THREADS, thread_name_prefix='api-async'
+    )
+
+
+def run_view(view, request, *args, **kwargs):
+    """Выполняет вьюху в потоке пула и сразу рендерит ответ.
+
+    Соединения с БД принадлежат потокам пула, поэтому устаревшие и
+    неработающие закрываются здесь же, как это делает Django в начале и
+    конце запроса, и к ним же подключается профилирование запроса.
+    """
+    close_old_connections()
+    close_unusable_connections()
+    profile = current_profile.get()
+    try:
+        with (profiled_connections(profile) if profile is not None
+              else nullcontext()):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """Асинхронная версия синхронной вьюхи «view»."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(
+            run_view, thread_sensitive=False, executor=get_executor()
+        )(view, request, *args, **kwargs)
+    return wrapper
+
+
+recipe_list = async_view(
+    RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+)
+tag_list = async_view(TagViewSet.as_view({'get': 'list'}))
+tag_detail = async_view(TagViewSet.as_view({'get': 'retrieve'}))
+ingredient_list = async_view(IngredientViewSet.as_view({'get': 'list'}))
+ingredient_detail = async_view(
+    IngredientViewSet.as_view({'get': 'retrieve'})
+)
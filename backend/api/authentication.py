@@ -0,0 +1,123 @@
+"""Аутентификация по токену с кешированием.
+
+Стандартная «TokenAuthentication» на каждый запрос делает запрос
+Token + CustomUser в БД. «CachedTokenAuthentication» сначала ищет пару
+(юзер, токен) в LRU-кеше процесса с коротким TTL, затем(опционально) в
+общем кеше Django и только потом идёт в основную БД(не в реплику: токен
+мог быть только что создан). Записи сбрасываются сигналами
+при удалении токена(logout), сохранении юзера(смена пароля, «is_active»)
+и изменении его избранного, корзины или подписок.
+
+Общий уровень работает только с общим для процессов бэкендом
+(«CACHE_BACKEND»): в LocMemCache сброс в одном воркере не виден другим, и
+они принимали бы старый токен до «SHARED_TTL» секунд.
+"""
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .routers import use_primary
+from .shared_cache import is_shared_cache
+
+
+class TokenCache:
+    """Двухуровневый кеш пар (юзер, токен) по ключу токена."""
+    def __init__(self):
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @property
+    def options(self):
+        return settings.AUTH_TOKEN_CACHE
+
+    @property
+    def shared(self):
+        return self.options['SHARED'] and is_shared_cache()
+
+    @staticmethod
+    def get_shared_key(key):
+        return f'auth-token:{key}'
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(key)
+                self.stats['local_hits'] += 1
+                return entry[1]
+        if self.shared:
+            value = cache.get(self.get_shared_key(key))
+            if value is not None:
+                self.stats['shared_hits'] += 1
+                self.set_local(key, value)
+                return value
+        self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        if self.shared:
+            cache.set(
+                self.get_shared_key(key), value, self.options['SHARED_TTL']
+            )
+        self.set_local(key, value)
+
+    def set_local(self, key, value):
+        expires = time.monotonic() + self.options['LOCAL_TTL']
+        with self._lock:
+            self._local[key] = (expires, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.options['LOCAL_SIZE']:
+                self._local.popitem(last=False)
+
+    def invalidate(self, keys):
+        keys = set(keys)
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        if self.shared and keys:
+            cache.delete_many([self.get_shared_key(key) for key in keys])
+        self.stats['invalidations'] += len(keys)
+
+    def invalidate_users(self, user_ids):
+        user_ids = set(user_ids)
+        keys = set(Token.objects.filter(
+            user_id__in=user_ids
+        ).values_list('key', flat=True))
+        with self._lock:
+            keys.update(
+                key for key, (_, (user, _)) in self._local.items()
+                if user.pk in user_ids
+            )
+        self.invalidate(keys)
+
+    def get_stats(self):
+        """Счётчики попаданий/промахов и доля попаданий."""
+        stats = dict(self.stats)
+        hits = stats.get('local_hits', 0) + stats.get('shared_hits', 0)
+        total = hits + stats.get('misses', 0)
+        stats['hit_rate'] = round(hits / total, 4) if total else None
+        stats['local_size'] = len(self._local)
+        stats['shared'] = self.shared
+        return stats
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            with use_primary():
+                cached = super().authenticate_credentials(key)
+            token_cache.set(key, cached)
+        user, token = cached
+        return copy.copy(user), token
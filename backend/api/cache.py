@@ -0,0 +1,192 @@
+"""Кеширование ответов и условные запросы.
+
+Кеш справочников(теги, ингредиенты) двухуровневый: LRU-словарь в памяти
+процесса и общий кеш Django(«CACHES['default']»). Актуальность
+проверяется по версии справочника, которая хранится в общем кеше и
+меняется сигналами при изменении данных, поэтому сброс виден всем
+процессам. По версии же строятся заголовки «ETag» и «Last-Modified».
+
+Для рецептов ETag строится по «Recipe.updated_at», версиям тегов,
+ингредиентов и авторов(вложенные данные рецепта) и отметке
+«CustomUser.relations_updated_at» текущего юзера, поэтому неизменённая
+страница стоит одного лёгкого запроса и ответа 304.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+
+
+class CatalogCache:
+    """Кеш сериализованных данных одного справочника."""
+    def __init__(self, name, maxsize=None, timeout=None):
+        self.name = name
+        self.maxsize = maxsize or settings.CATALOG_CACHE_LRU_SIZE
+        self.timeout = timeout or settings.CATALOG_CACHE_TIMEOUT
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def version_key(self):
+        return f'catalog:{self.name}:version'
+
+    def get_version(self):
+        """Текущая версия справочника: {'token': ..., 'modified': ...}."""
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, self.new_version(), self.timeout)
+            return cache.get(self.version_key)
+        return version
+
+    @staticmethod
+    def new_version():
+        return {'token': uuid.uuid4().hex[:16], 'modified': int(time.time())}
+
+    def invalidate(self):
+        cache.set(self.version_key, self.new_version(), self.timeout)
+        with self._lock:
+            self._local.clear()
+
+    def get(self, version, key):
+        local_key = (version['token'], key)
+        with self._lock:
+            if local_key in self._local:
+                self._local.move_to_end(local_key)
+                return self._local[local_key]
+        data = cache.get(f'catalog:{self.name}:{version["token"]}:{key}')
+        if data is not None:
+            self.set_local(local_key, data)
+        return data
+
+    def set(self, version, key, data):
+        cache.set(
+            f'catalog:{self.name}:{version["token"]}:{key}', data,
+            self.timeout
+        )
+        self.set_local((version['token'], key), data)
+
+    def set_local(self, local_key, data):
+        with self._lock:
+            self._local[local_key] = data
+            self._local.move_to_end(local_key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+
+tags_cache = CatalogCache('tags')
+ingredients_cache = CatalogCache('ingredients')
+# Данные не кешируются, версия нужна только для ETag рецептов.
+authors_cache = CatalogCache('authors')
+
+
+class CatalogCacheMixin:
+    """Миксин для read-only вьюсетов справочников.
+
+    Отдаёт «list»/«retrieve» из «catalog_cache» и отвечает 304 на
+    условные запросы с актуальными «If-None-Match»/«If-Modified-Since».
+    """
+    catalog_cache = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        version = self.catalog_cache.get_version()
+        etag = f'"{self.catalog_cache.name}-{version["token"]}"'
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=version['modified']
+        )
+        if not_modified is not None:
+            return not_modified
+        key = request.get_full_path()
+        data = self.catalog_cache.get(version, key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            self.catalog_cache.set(version, key, data)
+        return Response(data, headers={
+            'ETag': etag, 'Last-Modified': http_date(version['modified'])
+        })
+
+
+def get_weak_etag(*parts):
+    digest = hashlib.md5(
+        ':'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ConditionalRecipeMixin:
+    """Миксин для вьюсета рецептов: ETag и ответ 304 для «list»/«retrieve».
+
+    В ETag входят дата изменения рецептов, их количество, суммы счётчиков
+    популярности(от них зависит сортировка «popular»), версии тегов,
+    ингредиентов и авторов, параметры запроса и отметка об изменении
+    избранного, корзины и подписок юзера.
+    """
+    nested_caches = (tags_cache, ingredients_cache, authors_cache)
+
+    def get_nested_marker(self):
+        return '-'.join(
+            catalog.get_version()['token'] for catalog in self.nested_caches
+        )
+
+    def get_user_marker(self):
+        user = self.request.user
+        if user.is_anonymous:
+            return 'anonymous'
+        return f'{user.pk}-{user.relations_updated_at.timestamp()}'
+
+    def get_conditional_response(self, request, etag, handler, *args,
+                                 **kwargs):
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        state = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            modified=Max('updated_at'), count=Count('id'),
+            favorites=Sum('favorites_count'), in_carts=Sum('in_carts_count')
+        )
+        etag = get_weak_etag(
+            request.get_full_path(), state['modified'], state['count'],
+            state['favorites'], state['in_carts'], self.get_nested_marker(),
+            self.get_user_marker()
+        )
+        return self.get_conditional_response(
+            request, etag, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        modified = get_object_or_404(
+            self.queryset.values_list('updated_at', flat=True),
+            **{self.lookup_field: kwargs[lookup]}
+        )
+        etag = get_weak_etag(
+            request.get_full_path(), modified, self.get_nested_marker(),
+            self.get_user_marker()
+        )
+        return self.get_conditional_response(
+            request, etag, super().retrieve, *args, **kwargs
+        )
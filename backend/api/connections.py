@@ -0,0 +1,20 @@
+"""Проверка постоянных соединений с БД.
+
+При «CONN_MAX_AGE» больше нуля соединение переживает запрос, и к началу
+следующего его мог закрыть PostgreSQL или PgBouncer. В Django 3.2 нет
+«CONN_HEALTH_CHECKS», поэтому в начале запроса каждое открытое соединение
+проверяется(«is_usable») и закрывается, если не отвечает: Django откроет
+новое при первом запросе к БД вместо ошибки посреди обработки.
+"""
+from django.conf import settings
+from django.db import connections
+
+
+def close_unusable_connections(**kwargs):
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is not None
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
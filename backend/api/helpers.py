@@ -1,33 +1,84 @@
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from recipes.models import QuantityOfIngredients
+from recipes.matching import ingredient_index
+from recipes.models import QuantityOfIngredients, ShoppingCartIngredient
 from rest_framework.response import Response
 from rest_framework.status import (HTTP_201_CREATED, HTTP_204_NO_CONTENT,
                                    HTTP_400_BAD_REQUEST)
+from users.models import CustomUser
+
+from .relations import get_user_relations
 
 
 class Helper:
     """Класс созданный для вспомогательных методов."""
     def create_or_update_ingredients(self, instance, validated_data):
-        """Добавление ингредиентов в рецепт, при его создании/обновлении."""
-        for ingredient in validated_data:
-            QuantityOfIngredients.objects.create(
-                recipe=instance,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
-            )
+        """Добавление ингредиентов в рецепт, при его создании/обновлении.
+
+        Записывается только разница с текущим составом рецепта: новые
+        строки - через «bulk_create», изменённые - через «bulk_update»,
+        лишние удаляются одним запросом. Разница так же переносится в
+        списки покупок юзеров, у которых этот рецепт в корзине, а новый
+        состав - в индекс подбора рецептов по ингредиентам.
+        """
+        new_amounts = {
+            int(ingredient.get('id')): int(ingredient.get('amount'))
+            for ingredient in validated_data
+        }
+        current = {
+            row.ingredient_id: row for row in instance.ingredients.all()
+        }
+        old_amounts = {
+            ingredient: row.amount for ingredient, row in current.items()
+        }
+        to_create, to_update = [], []
+        for ingredient, amount in new_amounts.items():
+            row = current.get(ingredient)
+            if row is None:
+                to_create.append(QuantityOfIngredients(
+                    recipe=instance, ingredient_id=ingredient, amount=amount
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        removed = current.keys() - new_amounts.keys()
+        QuantityOfIngredients.objects.bulk_create(to_create)
+        QuantityOfIngredients.objects.bulk_update(to_update, ('amount',))
+        if removed:
+            QuantityOfIngredients.objects.filter(
+                recipe=instance, ingredient_id__in=removed
+            ).delete()
+        ShoppingCartIngredient.objects.change_recipe(
+            instance, old_amounts, new_amounts
+        )
+        ingredient_index.update_on_commit(instance.pk, new_amounts)
 
-    def post_or_delete(self, pk, instance):
-        """Добавление/удаление объекта из выбранного поля(instance)"""
+    def post_or_delete(self, pk, instance, relation):
+        """Добавление/удаление объекта из выбранного поля(instance)
+
+        relation: имя множества в «UserRelations», соответствующего полю.
+        Проверка и изменение связи выполняются в одной транзакции под
+        блокировкой строки юзера, загруженное множество связей
+        обновляется на месте. Общий кеш связей после записи сбрасывается
+        сигналом «relations_touched».
+        """
         pattern = get_object_or_404(self.queryset, id=pk)
-        validate_pattern = instance.filter(id=pk).exists()
+        relations = get_user_relations(self.request)
         serializer = self.additional_serializer(
             pattern, context={'request': self.request}
         )
-
-        if self.request.method == 'POST' and not validate_pattern:
-            instance.add(pattern)
-            return Response(serializer.data, status=HTTP_201_CREATED)
-        if self.request.method == 'DELETE' and validate_pattern:
-            instance.remove(pattern)
-            return Response(status=HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            # Параллельные запросы юзера ждут здесь, поэтому проверка и
+            # изменение связи не разделяются чужой записью. Связь
+            # проверяется в БД: кеш мог быть прочитан до блокировки.
+            CustomUser.objects.lock([self.request.user.pk])
+            validate_pattern = instance.filter(pk=pattern.id).exists()
+            if self.request.method == 'POST' and not validate_pattern:
+                instance.add(pattern)
+                relations.add(relation, pattern.id)
+                return Response(serializer.data, status=HTTP_201_CREATED)
+            if self.request.method == 'DELETE' and validate_pattern:
+                instance.remove(pattern)
+                relations.discard(relation, pattern.id)
+                return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
@@ -1,5 +1,53 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная(keyset) пагинация ленты рецептов по (-pub_date, id).
+
+    Позиция курсора хранится по первому полю сортировки, поэтому оно
+    должно быть почти уникальным и не меняться: у счётчиков популярности
+    много одинаковых значений, и они меняются между страницами.
+    """
+    ordering = ('-pub_date', 'id')
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipePagination(PageNumberLimitPagination):
+    """Пагинация ленты рецептов.
+
+    По умолчанию постраничная(«page»/«limit»). С параметром
+    «pagination=cursor»(или «cursor» из ссылок next/previous) переключается
+    на курсорную: без COUNT(*) и OFFSET, поэтому время ответа не зависит
+    от глубины страницы. Курсорная доступна только в сортировке по умолчанию
+    («ordering=new»).
+    """
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_paginator = None
+
+    def is_cursor_mode(self, request):
+        return (request.query_params.get('pagination') == 'cursor'
+                or 'cursor' in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_cursor_mode(request):
+            return super().paginate_queryset(queryset, request, view)
+        ordering = self.cursor_pagination_class.ordering
+        if hasattr(view, 'get_ordering') and view.get_ordering() != ordering:
+            raise ValidationError({'pagination': (
+                'Курсорная пагинация доступна только для сортировки «new».'
+            )})
+        self.cursor_paginator = self.cursor_pagination_class()
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
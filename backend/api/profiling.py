@@ -0,0 +1,247 @@
+"""Профилирование запросов к API(включается настройкой «PROFILING»).
+
+«ProfilingMiddleware» для каждого запроса считает количество и время
+SQL-запросов(через «connection.execute_wrapper»), находит повторяющиеся
+запросы(N+1) по нормализованному SQL, собирает время сериализации по
+полям(«TimedFieldsMixin») и отдельных этапов(«timed»). Итог пишется в
+заголовок «Server-Timing», медленные запросы - в лог «api.profiling»,
+а гистограммы длительности по эндпоинтам доступны через «metrics».
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TOP_FIELDS = 5
+NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+IN_LIST_RE = re.compile(r'\((\s*(\?|%s)\s*,)+\s*(\?|%s)\s*\)')
+
+
+def normalize_sql(sql):
+    """SQL без значений: одинаковые запросы с разными id совпадают."""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    return IN_LIST_RE.sub('(...)', sql)
+
+
+class RequestProfile:
+    """Данные профилирования одного запроса."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.sections = defaultdict(float)
+        self.fields = defaultdict(float)
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Обёртка «execute_wrapper» для всех запросов к БД."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[normalize_sql(sql)] += 1
+
+    def get_duplicates(self):
+        threshold = settings.PROFILING['DUPLICATE_QUERY_THRESHOLD']
+        return {
+            sql: count for sql, count in self.statements.items()
+            if count >= threshold
+        }
+
+    def get_server_timing(self, total):
+        timings = [
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"'
+        ]
+        timings.extend(
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in self.sections.items()
+        )
+        timings.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(timings)
+
+    def get_top_fields(self):
+        return {
+            name: round(duration * 1000, 2) for name, duration in sorted(
+                self.fields.items(), key=lambda item: -item[1]
+            )[:TOP_FIELDS]
+        }
+
+
+@contextmanager
+def profiled_connections(profile):
+    """Считает запросы к БД текущего потока в «profile»."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(profile))
+        yield
+
+
+@contextmanager
+def timed(name):
+    """Добавляет время блока к этапу «name» текущего запроса."""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+
+
+class TimedFieldsMixin:
+    """Миксин сериализатора: время вывода каждого поля при профилировании.
+
+    Повторяет «Serializer.to_representation», засекая время каждого поля;
+    время вложенных сериализаторов входит во время поля-родителя.
+    """
+    def to_representation(self, instance):
+        profile = current_profile.get()
+        if profile is None:
+            return super().to_representation(instance)
+        started = time.perf_counter()
+        profile.serializer_depth += 1
+        try:
+            return self.timed_representation(profile, instance)
+        finally:
+            profile.serializer_depth -= 1
+            if not profile.serializer_depth:
+                profile.sections['serialize'] += (
+                    time.perf_counter() - started
+                )
+
+    def timed_representation(self, profile, instance):
+        ret = OrderedDict()
+        prefix = type(self).__name__
+        for field in self._readable_fields:
+            started = time.perf_counter()
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = (
+                attribute.pk if isinstance(attribute, PKOnlyObject)
+                else attribute
+            )
+            ret[field.field_name] = (
+                None if check_for_none is None
+                else field.to_representation(attribute)
+            )
+            profile.fields[f'{prefix}.{field.field_name}'] += (
+                time.perf_counter() - started
+            )
+        return ret
+
+
+class Metrics:
+    """Гистограммы длительности запросов по эндпоинтам."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, duration, profile):
+        duration_ms = duration * 1000
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'count': 0, 'total_ms': 0.0, 'sql_ms': 0.0, 'queries': 0,
+                'buckets': [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+            })
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['sql_ms'] += profile.sql_time * 1000
+            stats['queries'] += profile.queries
+            position = next(
+                (index for index, bound in enumerate(HISTOGRAM_BUCKETS_MS)
+                 if duration_ms <= bound), len(HISTOGRAM_BUCKETS_MS)
+            )
+            stats['buckets'][position] += 1
+
+    def get_stats(self):
+        bounds = [*map(str, HISTOGRAM_BUCKETS_MS), '+Inf']
+        with self._lock:
+            return {
+                endpoint: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                    'avg_sql_ms': round(stats['sql_ms'] / stats['count'], 2),
+                    'avg_queries': round(
+                        stats['queries'] / stats['count'], 2
+                    ),
+                    'histogram_ms': dict(zip(bounds, stats['buckets'])),
+                }
+                for endpoint, stats in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+metrics = Metrics()
+
+
+class ProfilingMiddleware:
+    """Middleware профилирования(только при «PROFILING['ENABLED']»)."""
+    def __init__(self, get_response):
+        if not settings.PROFILING['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with profiled_connections(profile):
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        duration = time.perf_counter() - profile.started
+        response['Server-Timing'] = profile.get_server_timing(duration)
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unresolved'
+        metrics.observe(endpoint, duration, profile)
+        self.log(request, response, endpoint, duration, profile)
+        return response
+
+    def log(self, request, response, endpoint, duration, profile):
+        duplicates = profile.get_duplicates()
+        slow = duration * 1000 >= settings.PROFILING['SLOW_REQUEST_MS']
+        if not slow and not duplicates:
+            return
+        logger.warning(json.dumps({
+            'event': 'slow_request' if slow else 'duplicate_queries',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'sql_ms': round(profile.sql_time * 1000, 2),
+            'queries': profile.queries,
+            'duplicates': duplicates,
+            'sections_ms': {
+                name: round(value * 1000, 2)
+                for name, value in profile.sections.items()
+            },
+            'top_fields_ms': profile.get_top_fields(),
+        }, ensure_ascii=False))
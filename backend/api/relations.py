@@ -0,0 +1,119 @@
+"""Кеш связей юзера: избранное, список покупок и подписки.
+
+Множества id хранятся компактно - отсортированными массивами
+«array('I')», проверка принадлежности - двоичный поиск. Каждое множество
+загружается отдельным запросом при первом обращении и не больше одного
+раза за запрос, а если задан «USER_RELATIONS_CACHE_TIMEOUT» - сохраняется
+в общем кеше между запросами. Любое изменение связей сбрасывает кеш
+сигналом «relations_touched».
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from recipes.models import Recipe
+from users.models import CustomUser
+
+FAVORITES = 'favorites'
+PURCHASES = 'purchases'
+SUBSCRIPTIONS = 'subscriptions'
+# Промежуточная модель, поле юзера и поле связанного объекта.
+RELATIONS = {
+    FAVORITES: (Recipe.favorite.through, 'customuser_id', 'recipe_id'),
+    PURCHASES: (Recipe.purchase.through, 'customuser_id', 'recipe_id'),
+    SUBSCRIPTIONS: (
+        CustomUser.subscriber.through, 'to_customuser_id', 'from_customuser_id'
+    ),
+}
+
+
+def get_cache_key(user_id, name):
+    return f'relations:{user_id}:{name}'
+
+
+class UserRelations:
+    """Множества id рецептов в избранном/корзине и id авторов в подписках.
+
+    user_id: None для анонимного юзера(все множества пустые).
+    """
+    def __init__(self, user_id=None, timeout=0):
+        self.user_id = user_id
+        self.timeout = timeout
+        self.sets = {}
+
+    def get(self, name):
+        """Отсортированный массив id множества «name»."""
+        if name not in self.sets:
+            self.sets[name] = self.fetch(name)
+        return self.sets[name]
+
+    def fetch(self, name):
+        if self.user_id is None:
+            return array('I')
+        key = get_cache_key(self.user_id, name)
+        ids = cache.get(key) if self.timeout else None
+        if ids is None:
+            model, user_field, related_field = RELATIONS[name]
+            ids = array('I', sorted(model.objects.filter(
+                **{user_field: self.user_id}
+            ).values_list(related_field, flat=True)))
+            if self.timeout:
+                cache.set(key, ids, self.timeout)
+        return ids
+
+    def has(self, name, pk):
+        ids = self.get(name)
+        position = bisect_left(ids, pk)
+        return position < len(ids) and ids[position] == pk
+
+    def exists(self, name, pk):
+        """Как «has», но без загрузки всего множества, если его нет в кеше.
+
+        Для проверки одной связи(действия favorite, shopping_cart и
+        subscribe) хватает запроса EXISTS.
+        """
+        if self.user_id is None:
+            return False
+        if name in self.sets or self.timeout:
+            return self.has(name, pk)
+        model, user_field, related_field = RELATIONS[name]
+        return model.objects.filter(
+            **{user_field: self.user_id, related_field: pk}
+        ).exists()
+
+    def add(self, name, pk):
+        """Добавляет id в уже загруженное множество(общий кеш не меняет)."""
+        ids = self.sets.get(name)
+        if ids is None:
+            return
+        position = bisect_left(ids, pk)
+        if position == len(ids) or ids[position] != pk:
+            ids.insert(position, pk)
+
+    def discard(self, name, pk):
+        """Убирает id из уже загруженного множества(общий кеш не меняет)."""
+        ids = self.sets.get(name)
+        if ids is None:
+            return
+        position = bisect_left(ids, pk)
+        if position < len(ids) and ids[position] == pk:
+            del ids[position]
+
+
+def get_user_relations(request):
+    """Связи текущего юзера, общие для всех сериализаторов запроса."""
+    if getattr(request, '_user_relations', None) is None:
+        user = request.user
+        request._user_relations = UserRelations(
+            None if user.is_anonymous else user.pk,
+            settings.USER_RELATIONS_CACHE_TIMEOUT
+        )
+    return request._user_relations
+
+
+def invalidate_user_relations(user_ids):
+    cache.delete_many([
+        get_cache_key(user_id, name)
+        for user_id in user_ids for name in RELATIONS
+    ])
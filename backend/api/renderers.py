@@ -0,0 +1,71 @@
+import csv
+
+from django.http import Http404
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """Псевдо-файл для «csv.writer», возвращающий записанную строку."""
+    def write(self, value):
+        return value
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    """Неизвестный «?format=» - ошибка 406 со списком форматов, а не 404."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except Http404:
+            requested = format_suffix or request.query_params.get(
+                self.settings.URL_FORMAT_OVERRIDE
+            )
+            formats = ', '.join(renderer.format for renderer in renderers)
+            raise NotAcceptable(
+                f'Формат «{requested}» не поддерживается, '
+                f'доступные форматы: {formats}.'
+            )
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Наследники отдают список покупок потоком(метод «stream»), а «render»
+    нужен только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data).encode(self.charset)
+
+
+class ShoppingListTxtRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for ingredient in ingredients:
+            yield (
+                f'{ingredient["name"]}: '
+                f'{ingredient["amount"]} {ingredient["measurement_unit"]}\n'
+            )
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield '\ufeff' + writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        )
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['name'], ingredient['amount'],
+                ingredient['measurement_unit']
+            ))
@@ -0,0 +1,102 @@
+"""Чтение с реплик БД для безопасных запросов.
+
+«ReplicaRoutingMiddleware» помечает GET/HEAD/OPTIONS запросы, и на время
+их обработки «ReplicaRouter» отправляет чтение на одну из реплик
+(«DB_REPLICA_HOSTS»), запись всегда идёт в основную БД. После успешного
+изменяющего запроса юзер на «DB_REPLICA_PIN_SECONDS» секунд закрепляется
+за основной БД, чтобы видеть свои изменения(например, «is_favorited»
+сразу после добавления в избранное) несмотря на задержку репликации.
+Юзер определяется по хешу заголовка «Authorization»: в middleware
+аутентификация DRF ещё не выполнена. Отметка хранится в кеше Django,
+поэтому с репликами нужен общий для всех процессов бэкенд кеша: иначе
+GET, попавший в другой воркер, не увидит отметку и прочитает реплику.
+"""
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+from .shared_cache import is_shared_cache
+
+PRIMARY = 'default'
+REPLICA_PREFIX = 'replica_'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def get_replicas():
+    return [
+        alias for alias in settings.DATABASES
+        if alias.startswith(REPLICA_PREFIX)
+    ]
+
+
+@contextmanager
+def use_primary():
+    """Читать из основной БД внутри блока, даже в безопасном запросе."""
+    token = read_from_replica.set(False)
+    try:
+        yield
+    finally:
+        read_from_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Роутер: чтение с реплик в помеченных запросах, запись в основную БД."""
+    def __init__(self):
+        self.replicas = get_replicas()
+
+    def db_for_read(self, model, **hints):
+        if self.replicas and read_from_replica.get():
+            return random.choice(self.replicas)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        """Схема попадает на реплики репликацией, миграции - в основную БД."""
+        return db == PRIMARY
+
+
+def get_pin_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    digest = hashlib.sha256(authorization.encode()).hexdigest()
+    return f'replica-pin:{digest}'
+
+
+class ReplicaRoutingMiddleware:
+    """Middleware выбора БД для чтения(только при заданных репликах)."""
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+        if not is_shared_cache():
+            raise ImproperlyConfigured(
+                'DB_REPLICA_HOSTS требует общий для процессов кеш '
+                '(CACHE_BACKEND), иначе юзер не увидит свои изменения.'
+            )
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pin_key = get_pin_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if pin_key and response.status_code < 400:
+                cache.set(pin_key, True, settings.DB_REPLICA_PIN_SECONDS)
+            return response
+        replica = not (pin_key and cache.get(pin_key))
+        token = read_from_replica.set(replica)
+        try:
+            return self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
@@ -0,0 +1,14 @@
+"""Проверка, что кеш Django общий для всех процессов.
+
+Сброс кешей и версии, которые процессы сверяют между собой, работают
+только с общим бэкендом(«CACHE_BACKEND»). LocMemCache у каждого процесса
+свой, DummyCache ничего не хранит.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared_cache():
+    """Виден ли кеш Django всем процессам(не LocMem и не Dummy)."""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
@@ -0,0 +1,75 @@
+"""Сигналы приложения «api».
+
+Сброс кешей справочников, токенов и связей, а так же проверка постоянных
+соединений с БД в начале запроса.
+"""
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from recipes.models import Ingredient, Tag
+from rest_framework.authtoken.models import Token
+from users.models import CustomUser, relations_touched
+
+from .authentication import token_cache
+from .cache import authors_cache, ingredients_cache, tags_cache
+from .connections import close_unusable_connections
+from .relations import invalidate_user_relations
+
+# Поля юзера, которые попадают в рецепты как данные автора.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    tags_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    ingredients_cache.invalidate()
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.invalidate([instance.key])
+
+
+def author_changed(instance, update_fields):
+    """Изменились ли данные автора, которые видны в рецептах.
+
+    Сохранения без этих полей(например, «last_login» при входе) не
+    сбрасывают версию авторов, а значит и ETag всех рецептов.
+    """
+    if instance.pk is None:
+        return False
+    if update_fields is not None and not set(AUTHOR_FIELDS) & update_fields:
+        return False
+    old = CustomUser.objects.filter(pk=instance.pk).values(
+        *AUTHOR_FIELDS
+    ).first()
+    return old is not None and any(
+        old[field] != getattr(instance, field) for field in AUTHOR_FIELDS
+    )
+
+
+@receiver(pre_save, sender=CustomUser)
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    instance._author_changed = author_changed(instance, update_fields)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, **kwargs):
+    token_cache.invalidate_users([instance.pk])
+    if getattr(instance, '_author_changed', False):
+        authors_cache.invalidate()
+
+
+@receiver(relations_touched, sender=CustomUser)
+def user_relations_touched(sender, user_ids, **kwargs):
+    token_cache.invalidate_users(user_ids)
+    invalidate_user_relations(user_ids)
+
+
+request_started.connect(close_unusable_connections)
@@ -0,0 +1,714 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import connection, connections, router
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipes.matching import RecipeIngredientIndex
+from recipes.models import (Ingredient, QuantityOfIngredients, Recipe,
+                            RecipeSimilarity, ShoppingCartIngredient, Tag)
+from recipes.search import (IngredientPrefixIndex, RecipeSearchIndex,
+                            search_ingredients)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+from users.models import CustomUser
+
+from .cache import authors_cache
+from .connections import close_unusable_connections
+from .profiling import metrics
+from .relations import FAVORITES, PURCHASES, UserRelations
+from .routers import PRIMARY, REPLICA_PREFIX, read_from_replica
+
+RECIPES_COUNT = 60
+
+
+def create_recipes(author, count):
+    """Создаёт «count» рецептов с тегом, ингредиентами и отметками."""
+    tag = Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+    Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+        for number in range(3)
+    )
+    ingredients = list(Ingredient.objects.all())
+    Recipe.objects.bulk_create(
+        Recipe(
+            author=author, name=f'Рецепт {number}', text='Описание',
+            image='recipes/image.jpg', cooking_time=number + 1
+        ) for number in range(count)
+    )
+    recipes = list(Recipe.objects.filter(author=author))
+    Recipe.tag.through.objects.bulk_create(
+        Recipe.tag.through(recipe=recipe, tag=tag) for recipe in recipes
+    )
+    QuantityOfIngredients.objects.bulk_create(
+        QuantityOfIngredients(recipe=recipe, ingredient=ingredient, amount=10)
+        for recipe in recipes for ingredient in ingredients
+    )
+    author.favorites_recipes.add(*recipes[::2])
+    author.purchases.add(*recipes[::3])
+    return recipes
+
+
+class RecipeListQueriesTest(TestCase):
+    """Количество запросов к БД для списка рецептов не зависит от limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        create_recipes(cls.user, RECIPES_COUNT)
+
+    def count_queries(self, client, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def test_queries_do_not_grow_with_limit(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(
+            self.count_queries(client, 1), self.count_queries(client, 50)
+        )
+
+    def test_anonymous_queries_do_not_grow_with_limit(self):
+        client = APIClient()
+        self.assertEqual(
+            self.count_queries(client, 1), self.count_queries(client, 50)
+        )
+
+    def test_flags_come_from_annotations(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/recipes/', {'limit': RECIPES_COUNT})
+        favorited = set(
+            self.user.favorites_recipes.values_list('id', flat=True)
+        )
+        purchased = set(self.user.purchases.values_list('id', flat=True))
+        for recipe in response.data['results']:
+            self.assertEqual(
+                recipe['is_favorited'], recipe['id'] in favorited
+            )
+            self.assertEqual(
+                recipe['is_in_shopping_cart'], recipe['id'] in purchased
+            )
+
+
+class ConnectionReuseTest(TransactionTestCase):
+    """Постоянные соединения с БД переживают запрос и проверяются."""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не закрывает соединения, '
+                          'задайте DB_TEST_NAME')
+        self.addCleanup(
+            self.set_max_age, connection.settings_dict['CONN_MAX_AGE']
+        )
+
+    def set_max_age(self, max_age):
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+
+    def request(self, path):
+        """Запрос через WSGI-обработчик, как под gunicorn.
+
+        В отличие от тестового клиента, обработчик закрывает устаревшие
+        соединения сигналами начала и конца запроса.
+        """
+        environ = {'PATH_INFO': path, 'HTTP_HOST': 'testserver'}
+        setup_testing_defaults(environ)
+        response = WSGIHandler()(environ, lambda status, headers: None)
+        b''.join(response)
+        response.close()
+        return response.status_code
+
+    def test_connection_reused_across_requests(self):
+        self.set_max_age(60)
+        self.assertEqual(self.request('/api/recipes/'), 200)
+        first = connection.connection
+        self.assertIsNotNone(first)
+        self.assertEqual(self.request('/api/recipes/'), 200)
+        self.assertIs(connection.connection, first)
+
+    def test_connection_closed_without_max_age(self):
+        self.set_max_age(0)
+        self.assertEqual(self.request('/api/recipes/'), 200)
+        self.assertIsNone(connection.connection)
+
+    @override_settings(DB_CONN_HEALTH_CHECKS=True)
+    def test_unusable_connection_closed(self):
+        self.set_max_age(60)
+        connection.ensure_connection()
+        with mock.patch.object(connection, 'is_usable', return_value=False):
+            close_unusable_connections()
+        self.assertIsNone(connection.connection)
+
+    @override_settings(DB_CONN_HEALTH_CHECKS=True)
+    def test_usable_connection_kept(self):
+        self.set_max_age(60)
+        connection.ensure_connection()
+        first = connection.connection
+        close_unusable_connections()
+        self.assertIs(connection.connection, first)
+
+
+class ShoppingCartTotalsTest(TestCase):
+    """Материализованные списки покупок совпадают с живым агрегатом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.buyers = [
+            CustomUser.objects.create_user(
+                username=f'buyer{number}', email=f'buyer{number}@example.com',
+                first_name='Иван', last_name='Иванов', password='password-123'
+            ) for number in range(3)
+        ]
+        cls.recipes = create_recipes(cls.buyers[0], 6)
+        for number, buyer in enumerate(cls.buyers):
+            buyer.purchases.add(*cls.recipes[number:number + 4])
+
+    def stored_totals(self):
+        return {
+            (user, ingredient): amount
+            for user, ingredient, amount in ShoppingCartIngredient.objects
+            .values_list('user_id', 'ingredient_id', 'amount')
+        }
+
+    def test_filtered_totals_match_full_totals(self):
+        totals = ShoppingCartIngredient.objects.live_totals()
+        users = [buyer.pk for buyer in self.buyers[1:]]
+        self.assertEqual(
+            ShoppingCartIngredient.objects.live_totals(users),
+            {key: total for key, total in totals.items() if key[0] in users}
+        )
+
+    def test_totals_count_each_purchase_once(self):
+        totals = ShoppingCartIngredient.objects.live_totals(
+            [self.buyers[2].pk]
+        )
+        for (user, _), total in totals.items():
+            self.assertEqual(user, self.buyers[2].pk)
+            self.assertEqual(total, 10 * self.buyers[2].purchases.count())
+
+    def test_rebuild_of_some_users_keeps_totals(self):
+        ShoppingCartIngredient.objects.rebuild([self.buyers[1].pk])
+        self.assertEqual(
+            self.stored_totals(), ShoppingCartIngredient.objects.live_totals()
+        )
+
+    def test_signals_keep_totals(self):
+        self.buyers[1].purchases.remove(self.recipes[1])
+        self.recipes[3].purchase.clear()
+        self.buyers[2].purchases.add(self.recipes[0])
+        self.assertEqual(
+            self.stored_totals(), ShoppingCartIngredient.objects.live_totals()
+        )
+
+
+class AuthorsCacheTest(TestCase):
+    """Версия авторов меняется только вместе с данными автора в рецептах."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        self.version = authors_cache.get_version()
+
+    def test_login_keeps_version(self):
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=('last_login',))
+        self.assertEqual(authors_cache.get_version(), self.version)
+
+    def test_save_without_author_changes_keeps_version(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(authors_cache.get_version(), self.version)
+
+    def test_author_change_bumps_version(self):
+        self.user.first_name = 'Пётр'
+        self.user.save()
+        self.assertNotEqual(authors_cache.get_version(), self.version)
+
+
+class MetricsViewTest(APITestCase):
+    """Метрики профилирования и кеша аутентификации в одном эндпоинте."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        cls.user = CustomUser.objects.create_user(
+            username='user', email='user@example.com',
+            first_name='Пётр', last_name='Петров', password='password-123'
+        )
+
+    def test_admin_gets_auth_cache_stats(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth_cache', response.data)
+        self.assertIn('endpoints', response.data)
+
+    def test_user_is_forbidden(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+class RelationsTest(APITestCase):
+    """Добавление в избранное/корзину, кеш связей юзера и ETag рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        cls.recipes = create_recipes(cls.user, 6)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.recipe = self.recipes[1]
+        self.url = f'/api/recipes/{self.recipe.pk}/favorite/'
+
+    def test_relation_sets(self):
+        relations = UserRelations(self.user.pk)
+        for recipe in self.recipes:
+            self.assertEqual(
+                relations.exists(FAVORITES, recipe.pk),
+                recipe.pk in {item.pk for item in self.recipes[::2]}
+            )
+            self.assertEqual(
+                relations.has(PURCHASES, recipe.pk),
+                recipe.pk in {item.pk for item in self.recipes[::3]}
+            )
+        self.assertFalse(UserRelations().has(FAVORITES, self.recipe.pk))
+
+    def test_toggle_favorite(self):
+        self.assertEqual(self.client.post(self.url).status_code, 201)
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertEqual(self.client.delete(self.url).status_code, 400)
+
+    @override_settings(USER_RELATIONS_CACHE_TIMEOUT=60)
+    def test_shared_cache_invalidated_on_toggle(self):
+        detail = f'/api/recipes/{self.recipe.pk}/'
+        self.assertFalse(self.client.get(detail).data['is_favorited'])
+        self.client.post(self.url)
+        self.assertTrue(self.client.get(detail).data['is_favorited'])
+
+    def test_not_modified_until_relations_change(self):
+        response = self.client.get('/api/recipes/')
+        etag = response['ETag']
+        response = self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.client.post(self.url)
+        response = self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class SearchIndexTest(APITestCase):
+    """Индексы поиска в памяти процесса согласованы общей версией.
+
+    Отдельные экземпляры индекса играют роль разных процессов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        cls.recipes = create_recipes(cls.user, 3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_recipe_update_reaches_other_process(self):
+        first, second = RecipeSearchIndex(), RecipeSearchIndex()
+        self.assertEqual(second.search('борщ'), [])
+        recipe = self.recipes[0]
+        Recipe.objects.filter(pk=recipe.pk).update(name='Борщ')
+        first.update(recipe.pk, 'Борщ', recipe.text, '')
+        self.assertEqual(first.search('борщ'), [recipe.pk])
+        self.assertEqual(second.search('борщ'), [recipe.pk])
+
+    def test_ingredient_change_reaches_other_process(self):
+        other = IngredientPrefixIndex()
+        self.assertEqual(other.search('корианд', 10), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(
+                name='Кориандр', measurement_unit='г'
+            )
+        self.assertEqual(other.search('корианд', 10), [ingredient.pk])
+        self.assertEqual(search_ingredients('корианд', 10), [ingredient])
+
+    def test_rebuild_command_resets_other_processes(self):
+        other = RecipeSearchIndex()
+        self.assertEqual(other.search('борщ'), [])
+        Recipe.objects.filter(pk=self.recipes[1].pk).update(name='Борщ')
+        call_command('rebuild_search_index')
+        self.assertEqual(other.search('борщ'), [self.recipes[1].pk])
+
+    def test_search_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Свёкла', measurement_unit='г')
+        response = self.client.get('/api/recipes/search/', {'q': 'рецепт'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], len(self.recipes))
+        response = self.client.get('/api/recipes/search/')
+        self.assertEqual(response.status_code, 400)
+
+
+class IngredientMatchingTest(APITestCase):
+    """Подбор рецептов по имеющимся ингредиентам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        cls.recipes = create_recipes(cls.user, 3)
+        cls.ingredients = list(Ingredient.objects.order_by('id'))
+        QuantityOfIngredients.objects.filter(
+            recipe=cls.recipes[1], ingredient=cls.ingredients[2]
+        ).delete()
+        QuantityOfIngredients.objects.filter(
+            recipe=cls.recipes[2], ingredient__in=cls.ingredients[1:]
+        ).delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ranked_by_coverage(self):
+        first, second, third = self.recipes
+        ingredients = [ingredient.pk for ingredient in self.ingredients[:2]]
+        # Полное покрытие выше частичного, при равенстве - по id.
+        self.assertEqual(RecipeIngredientIndex().match(ingredients), [
+            *sorted([(second.pk, 2, 2), (third.pk, 1, 1)]), (first.pk, 2, 3)
+        ])
+
+    def test_update_reaches_other_process(self):
+        first, second = RecipeIngredientIndex(), RecipeIngredientIndex()
+        second.match([])
+        recipe, ingredient = self.recipes[2], self.ingredients[2]
+        QuantityOfIngredients.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=5
+        )
+        first.update(recipe.pk, [self.ingredients[0].pk, ingredient.pk])
+        self.assertIn((recipe.pk, 1, 2), second.match([ingredient.pk]))
+
+    def test_match_endpoint(self):
+        response = self.client.get('/api/recipes/match/', {
+            'ingredients': f'{self.ingredients[0].pk},{self.ingredients[1].pk}'
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([recipe['id'] for recipe in results], [
+            *sorted([self.recipes[1].pk, self.recipes[2].pk]),
+            self.recipes[0].pk
+        ])
+        self.assertEqual(results[2]['coverage'], 0.67)
+        self.assertEqual(
+            [ingredient['id'] for ingredient in results[2]['missing']],
+            [self.ingredients[2].pk]
+        )
+
+    def test_match_requires_ingredients(self):
+        response = self.client.get('/api/recipes/match/')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/recipes/match/', {'ingredients': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RecommendationsTest(TestCase):
+    """Инкрементальный пересчёт похожих рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                first_name='Иван', last_name='Иванов', password='password-123'
+            ) for number in range(2)
+        ]
+        cls.recipes = create_recipes(cls.users[0], 3)
+        Recipe.favorite.through.objects.all().delete()
+        Recipe.purchase.through.objects.all().delete()
+        for user in cls.users:
+            user.favorites_recipes.add(*cls.recipes[:2])
+
+    def similar(self, recipe):
+        return set(RecipeSimilarity.objects.filter(
+            recipe=recipe
+        ).values_list('similar_id', flat=True))
+
+    def test_removed_relations_are_recomputed(self):
+        first, second, _ = self.recipes
+        call_command('build_recommendations')
+        self.assertEqual(self.similar(first), {second.pk})
+        for user in self.users:
+            user.favorites_recipes.remove(first)
+        call_command('build_recommendations', '--since-minutes', '5')
+        self.assertEqual(self.similar(first), set())
+        self.assertEqual(self.similar(second), set())
+
+    def test_cleared_relations_are_recomputed(self):
+        first, second, _ = self.recipes
+        call_command('build_recommendations')
+        second.favorite.clear()
+        call_command('build_recommendations', '--since-minutes', '5')
+        self.assertEqual(self.similar(first), set())
+        self.assertEqual(self.similar(second), set())
+
+
+class PopularityCountersTest(APITestCase):
+    """Счётчики популярности, сортировка «popular» и курсорная пагинация."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                first_name='Иван', last_name='Иванов', password='password-123'
+            ) for number in range(3)
+        ]
+        cls.recipes = create_recipes(cls.users[0], 5)
+
+    def toggle(self, user, recipe, relation, method):
+        self.client.force_authenticate(user)
+        return getattr(self.client, method)(
+            f'/api/recipes/{recipe.pk}/{relation}/'
+        )
+
+    def assert_counters_match(self):
+        for recipe in Recipe.objects.with_live_counts():
+            self.assertEqual(recipe.favorites_count, recipe.live_favorites)
+            self.assertEqual(recipe.in_carts_count, recipe.live_in_carts)
+        call_command('reconcile_recipe_counters', '--check')
+
+    def test_counters_follow_toggles(self):
+        target = self.recipes[-1]
+        for user in self.users:
+            self.toggle(user, target, 'favorite', 'post')
+            self.toggle(user, target, 'shopping_cart', 'post')
+        self.assertEqual(
+            self.toggle(self.users[1], target, 'favorite', 'post').status_code,
+            400
+        )
+        self.toggle(self.users[1], target, 'favorite', 'delete')
+        self.toggle(self.users[1], target, 'favorite', 'delete')
+        self.assert_counters_match()
+        target.refresh_from_db()
+        self.assertEqual(target.favorites_count, 2)
+        self.assertEqual(target.in_carts_count, 3)
+
+    def test_counters_follow_bulk_changes(self):
+        self.users[1].favorites_recipes.add(*self.recipes)
+        self.recipes[0].favorite.clear()
+        self.users[0].purchases.clear()
+        self.users[1].favorites_recipes.remove(*self.recipes[1:3])
+        self.assert_counters_match()
+
+    def test_popular_ordering(self):
+        target = self.recipes[-1]
+        for user in self.users:
+            user.favorites_recipes.add(target)
+        response = self.client.get('/api/recipes/', {'ordering': 'popular'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], target.pk)
+
+    def test_cursor_pagination(self):
+        response = self.client.get(
+            '/api/recipes/', {'pagination': 'cursor', 'limit': 2}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertNotIn('count', response.data)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_cursor_pagination_requires_default_ordering(self):
+        for ordering in ('popular', 'cooking_time'):
+            response = self.client.get('/api/recipes/', {
+                'pagination': 'cursor', 'ordering': ordering
+            })
+            self.assertEqual(response.status_code, 400)
+
+
+PROFILING_ON = {
+    'ENABLED': True, 'SLOW_REQUEST_MS': 10 ** 6,
+    'DUPLICATE_QUERY_THRESHOLD': 2,
+}
+
+
+class ProfilingTest(APITestCase):
+    """Заголовок «Server-Timing», метрики эндпоинтов и журнал повторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        create_recipes(cls.user, 3)
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_disabled_by_default(self):
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.get_stats(), {})
+
+    @override_settings(PROFILING=PROFILING_ON)
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        queries = len(context.captured_queries)
+        self.assertIn(f'desc="{queries} queries"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        stats = metrics.get_stats()['api:recipes-list']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['avg_queries'], queries)
+
+    @override_settings(PROFILING={**PROFILING_ON, 'SLOW_REQUEST_MS': 0})
+    def test_slow_request_logged(self):
+        with self.assertLogs('api.profiling', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['event'], 'slow_request')
+        self.assertEqual(record['endpoint'], 'api:recipes-list')
+        self.assertGreater(record['queries'], 0)
+
+
+REPLICA = f'{REPLICA_PREFIX}test'
+
+
+class ReplicaRoutingTest(APITestCase):
+    """Чтение с реплики, запись и закрепление юзера за основной БД.
+
+    Реплика - отдельная БД SQLite с той же схемой, но своими данными,
+    поэтому по ответу видно, из какой БД он прочитан. Она подключается
+    после загрузки данных основной БД и не входит в транзакцию теста.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.temp_dir = tempfile.mkdtemp()
+        connections.databases[REPLICA] = {
+            **connections.databases[PRIMARY],
+            'NAME': os.path.join(cls.temp_dir, 'replica.sqlite3'),
+        }
+        call_command('migrate', database=REPLICA, verbosity=0)
+        # На реплике есть юзер и токен, но ещё нет рецептов.
+        cls.user.save(using=REPLICA)
+        cls.token.save(using=REPLICA)
+        cls.routing = override_settings(
+            DATABASE_ROUTERS=['api.routers.ReplicaRouter'],
+            CACHES={'default': {
+                'BACKEND': (
+                    'django.core.cache.backends.filebased.FileBasedCache'
+                ),
+                'LOCATION': os.path.join(cls.temp_dir, 'cache'),
+            }},
+            DB_REPLICA_PIN_SECONDS=5
+        )
+        cls.routing.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            cls.routing.disable()
+            connections[REPLICA].close()
+            del connections[REPLICA]
+            del connections.databases[REPLICA]
+            shutil.rmtree(cls.temp_dir)
+        finally:
+            super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Иван', last_name='Иванов', password='password-123'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipes = create_recipes(cls.user, 2)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_count(self, client):
+        response = client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['count']
+
+    def test_router(self):
+        self.assertEqual(router.db_for_write(Recipe), PRIMARY)
+        self.assertEqual(router.db_for_read(Recipe), PRIMARY)
+        token = read_from_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Recipe), REPLICA)
+        finally:
+            read_from_replica.reset(token)
+        self.assertTrue(router.allow_migrate(PRIMARY, 'recipes'))
+        self.assertFalse(router.allow_migrate(REPLICA, 'recipes'))
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.get_count(self.client), 0)
+
+    def test_writes_go_to_primary(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        recipe = self.recipes[1]
+        response = self.client.post(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(self.user.favorites_recipes.filter(
+            pk=recipe.pk
+        ).exists())
+        self.assertFalse(
+            Recipe.favorite.through.objects.using(REPLICA).exists()
+        )
+
+    def test_pinned_to_primary_after_write(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.get_count(self.client), 0)
+        self.client.post(f'/api/recipes/{self.recipes[1].pk}/favorite/')
+        self.assertEqual(self.get_count(self.client), len(self.recipes))
+        self.assertEqual(self.get_count(APIClient()), 0)
+        other = APIClient(HTTP_AUTHORIZATION='Token other')
+        self.assertEqual(other.get('/api/recipes/').status_code, 401)
+
+    def test_failed_write_does_not_pin(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        response = self.client.post('/api/recipes/0/favorite/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.get_count(self.client), 0)
+
+    def test_pin_expires(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.client.post(f'/api/recipes/{self.recipes[1].pk}/favorite/')
+        later = time.time() + 6
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self.get_count(self.client), 0)
@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (IngredientViewSet, RecipeViewSet, SubscribeUserViewSet,
-                    TagViewSet)
+from .views import (IngredientViewSet, MetricsView, RecipeViewSet,
+                    SubscribeUserViewSet, TagViewSet)
 
 app_name = 'api'
 
@@ -14,7 +15,22 @@ router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('users', SubscribeUserViewSet, basename='users')
 
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
     path('', include('djoser.urls'))
 ]
+
+if settings.ASYNC_VIEWS:
+    from . import async_views
+
+    urlpatterns = [
+        path('recipes/', async_views.recipe_list, name='recipes-list'),
+        path('tags/', async_views.tag_list, name='tags-list'),
+        path('tags/<int:pk>/', async_views.tag_detail, name='tags-detail'),
+        path('ingredients/', async_views.ingredient_list,
+             name='ingredients-list'),
+        path('ingredients/<int:pk>/', async_views.ingredient_detail,
+             name='ingredients-detail'),
+        *urlpatterns
+    ]
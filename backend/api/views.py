@@ -1,45 +1,118 @@
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Sum
+from django.http import StreamingHttpResponse
 from djoser.views import UserViewSet
-from recipes.models import Ingredient, QuantityOfIngredients, Recipe, Tag
+from foodgram.constants import (AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT,
+                                MAX_MATCH_INGREDIENTS)
+from recipes.matching import ingredient_index
+from recipes.models import Ingredient, Recipe, ShoppingCartIngredient, Tag
+from recipes.search import search_ingredients, search_recipes
 from recipes.serializers import (IngredientSerializer, RecipeSerializer,
                                  TagSerializer)
 from rest_framework import filters, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.status import HTTP_204_NO_CONTENT
+from rest_framework.views import APIView
 from users.models import CustomUser
 from users.serializers import (FavoriteAndPurchaseSerializer,
-                               SubscribeSerializer)
+                               SubscribeSerializer, get_recipes_limit)
 
+from .authentication import token_cache
+from .cache import (CatalogCacheMixin, ConditionalRecipeMixin,
+                    ingredients_cache, tags_cache)
 from .helpers import Helper
-from .paginations import PageNumberLimitPagination
+from .paginations import PageNumberLimitPagination, RecipePagination
 from .permissions import IsOwnerOrReadonlyPermission
+from .profiling import metrics
+from .relations import FAVORITES, PURCHASES, SUBSCRIPTIONS, get_user_relations
+from .renderers import (ShoppingListContentNegotiation,
+                        ShoppingListCSVRenderer, ShoppingListTxtRenderer)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class MetricsView(APIView):
+    """Метрики профилирования и кеша аутентификации(только для админов)."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'enabled': settings.PROFILING['ENABLED'],
+            'endpoints': metrics.get_stats(),
+            'auth_cache': token_cache.get_stats(),
+        })
+
+    def delete(self, request):
+        metrics.reset()
+        return Response(status=HTTP_204_NO_CONTENT)
+
+
+class TagViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_cache = tags_cache
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogCacheMixin, viewsets.ReadOnlyModelViewSet):
+    catalog_cache = ingredients_cache
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (filters.SearchFilter,)
     search_fields = ('name',)
 
+    def list(self, request, *args, **kwargs):
+        """Список ингредиентов или автодополнение по параметру «name»."""
+        if 'name' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        return self.get_cached_response(self.autocomplete, request)
+
+    def autocomplete(self, request):
+        """Автодополнение ингредиентов.
+
+        Сначала идут ингредиенты, название которых начинается с «name»,
+        затем содержащие его; количество результатов ограничивается
+        параметром «limit».
+        """
+        try:
+            limit = int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            limit = AUTOCOMPLETE_LIMIT
+        limit = min(max(limit, 1), MAX_AUTOCOMPLETE_LIMIT)
+        serializer = self.get_serializer(
+            search_ingredients(request.query_params['name'], limit),
+            many=True
+        )
+        return Response(serializer.data)
+
 
 class SubscribeUserViewSet(UserViewSet, Helper):
     queryset = CustomUser.objects.all()
     additional_serializer = SubscribeSerializer
 
+    def get_queryset(self):
+        return super().get_queryset().with_is_subscribed(self.request.user)
+
     @action(methods=['GET'], detail=False,
             permission_classes=(IsAuthenticated,))
     def subscriptions(self, request):
-        """Метод выводит список пользователей, на которых есть подписка."""
-        user = request.user
-        queryset = user.subscribers.all()
+        """Метод выводит список пользователей, на которых есть подписка.
+
+        Количество рецептов считается в основном запросе, а сами рецепты
+        (не больше «recipes_limit» на автора) подгружаются одним запросом,
+        поэтому страница стоит фиксированного числа запросов.
+        """
+        recipes = Recipe.objects.all()
+        limit = get_recipes_limit(request)
+        if limit:
+            recipes = recipes.latest_per_author(limit)
+        queryset = request.user.subscribers.annotate(
+            recipes_count=Count('recipes')
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='latest_recipes')
+        ).order_by('id')
         page = self.paginate_queryset(queryset)
         serializer = self.additional_serializer(
             page, many=True,
@@ -51,83 +124,193 @@ class SubscribeUserViewSet(UserViewSet, Helper):
             permission_classes=(IsAuthenticated,), detail=True)
     def subscribe(self, request, id):
         """Метод для подписки/отписки от пользователя."""
-        return self.post_or_delete(id, request.user.subscribers)
+        return self.post_or_delete(
+            id, request.user.subscribers, SUBSCRIPTIONS
+        )
 
 
-class RecipeViewSet(viewsets.ModelViewSet, Helper):
+class RecipeViewSet(ConditionalRecipeMixin, viewsets.ModelViewSet, Helper):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsOwnerOrReadonlyPermission,)
-    pagination_class = PageNumberLimitPagination
+    pagination_class = RecipePagination
     additional_serializer = FavoriteAndPurchaseSerializer
+    orderings = {
+        'new': ('-pub_date', 'id'),
+        'popular': ('-favorites_count', '-in_carts_count', '-pub_date', 'id'),
+        'cooking_time': ('cooking_time', 'id'),
+    }
 
     def perform_create(self, serializer):
-        return serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        serializer.instance = self.get_related_queryset().get(pk=recipe.pk)
+
+    def perform_update(self, serializer):
+        recipe = serializer.save()
+        serializer.instance = self.get_related_queryset().get(pk=recipe.pk)
+
+    def get_related_queryset(self):
+        """Рецепты с общим планом загрузки для всех ответов вьюсета."""
+        return self.queryset.with_related(self.request.user)
+
+    def get_ordering(self):
+        """Сортировка ленты из параметра «ordering»(по умолчанию «new»)."""
+        return self.orderings.get(
+            self.request.query_params.get('ordering'), self.orderings['new']
+        )
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = self.get_related_queryset().order_by(*self.get_ordering())
         tags = self.request.query_params.getlist('tags')
         if tags:
-            queryset = queryset.filter(tag__slug__in=tags).distinct()
+            queryset = queryset.filter(Exists(
+                Recipe.tag.through.objects.filter(
+                    recipe=OuterRef('pk'), tag__slug__in=tags
+                )
+            ))
         author = self.request.query_params.get('author')
         if author:
             queryset = queryset.filter(author=author)
-        user = self.request.user
-        if user.is_anonymous:
+        if self.request.user.is_anonymous:
             return queryset
-        query = [
-            {
-                '1': queryset.filter(favorite=user.id),
-                '0': queryset.exclude(favorite=user.id)
-            },
-            {
-                '1': queryset.filter(purchase=user.id),
-                '0': queryset.exclude(purchase=user.id)
-            }
-        ]
+        flags = {'1': True, '0': False}
         is_favorited = self.request.query_params.get('is_favorited')
         is_in_shopping_cart = self.request.query_params.get(
             'is_in_shopping_cart'
         )
-        if is_favorited:
-            queryset = query[0][is_favorited]
-        elif is_in_shopping_cart:
-            queryset = query[1][is_in_shopping_cart]
+        if is_favorited in flags:
+            queryset = queryset.filter(is_favorited=flags[is_favorited])
+        elif is_in_shopping_cart in flags:
+            queryset = queryset.filter(
+                is_in_shopping_cart=flags[is_in_shopping_cart]
+            )
         return queryset
 
+    @action(methods=['GET'], detail=False,
+            pagination_class=PageNumberLimitPagination)
+    def search(self, request):
+        """Полнотекстовый поиск рецептов по параметру «q».
+
+        Ищет по названию, описанию и ингредиентам, результаты отсортированы
+        по релевантности. Фильтры ленты(«tags», «author» и т.д.) тоже
+        применяются.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'Введите поисковый запрос.'})
+        page = self.paginate_queryset(
+            search_recipes(self.get_queryset(), query)
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_match_ingredients(self, request):
+        """Id ингредиентов из «?ingredients=1&ingredients=2» или «1,2»."""
+        values = [
+            value for param in request.query_params.getlist('ingredients')
+            for value in param.split(',') if value.strip()
+        ]
+        if not values:
+            raise ValidationError(
+                {'ingredients': 'Укажите id имеющихся ингредиентов.'}
+            )
+        if len(values) > MAX_MATCH_INGREDIENTS:
+            raise ValidationError({'ingredients': (
+                f'Не больше {MAX_MATCH_INGREDIENTS} ингредиентов.'
+            )})
+        try:
+            return {int(value) for value in values}
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Id ингредиентов должны быть числами.'}
+            )
+
+    @action(methods=['GET'], detail=False,
+            pagination_class=PageNumberLimitPagination)
+    def match(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов.
+
+        Отсортированы по доле ингредиентов рецепта, которые уже есть
+        («coverage»), к каждому рецепту добавлены недостающие ингредиенты
+        («missing»).
+        """
+        ingredients = self.get_match_ingredients(request)
+        page = self.paginate_queryset(ingredient_index.match(ingredients))
+        recipes = self.get_related_queryset().in_bulk(
+            [pk for pk, _, _ in page]
+        )
+        data = []
+        for pk, matched, total in page:
+            if pk not in recipes:
+                continue
+            recipe = self.get_serializer(recipes[pk]).data
+            recipe['coverage'] = round(matched / total, 2)
+            recipe['missing'] = [
+                ingredient for ingredient in recipe['ingredients']
+                if ingredient['id'] not in ingredients
+            ]
+            data.append(recipe)
+        return self.get_paginated_response(data)
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=(IsAuthenticated,),
+            pagination_class=PageNumberLimitPagination)
+    def recommended(self, request):
+        """Рекомендованные рецепты по избранному и списку покупок юзера.
+
+        Складывает близость рецептов из таблицы «RecipeSimilarity» для всех
+        отмеченных юзером рецептов, сами отмеченные рецепты исключаются.
+        """
+        relations = get_user_relations(request)
+        seeds = {*relations.get(FAVORITES), *relations.get(PURCHASES)}
+        queryset = self.get_related_queryset().filter(
+            recommended_by__recipe__in=seeds
+        ).exclude(id__in=seeds).annotate(
+            score=Sum('recommended_by__score')
+        ).order_by('-score', 'id')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(methods=['POST', 'DELETE'], pagination_class=None,
             permission_classes=(IsAuthenticated,), detail=True)
     def favorite(self, request, pk):
         """Метод для добавления/удаления рецепта из избранного."""
-        return self.post_or_delete(pk, request.user.favorites_recipes)
+        return self.post_or_delete(
+            pk, request.user.favorites_recipes, FAVORITES
+        )
 
     @action(methods=['POST', 'DELETE'], pagination_class=None,
             permission_classes=(IsAuthenticated,), detail=True)
     def shopping_cart(self, request, pk):
         """Метод для добавления/удаления рецепта из списка покупок."""
-        return self.post_or_delete(pk, request.user.purchases)
+        return self.post_or_delete(pk, request.user.purchases, PURCHASES)
 
     @action(methods=['GET'], detail=False,
-            permission_classes=(IsAuthenticated,))
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingListTxtRenderer,
+                              ShoppingListCSVRenderer),
+            content_negotiation_class=ShoppingListContentNegotiation)
     def download_shopping_cart(self, request):
-        """Метод для загрузки списка покупок пользователя в формате txt."""
-        user = request.user
-        ingredients = QuantityOfIngredients.objects.filter(
-            recipe__in=(user.purchases.values('id'))
+        """Метод для загрузки списка покупок пользователя.
+
+        Формат выбирается параметром «?format=txt|csv»(по умолчанию txt),
+        на другие форматы(например pdf) отвечает ошибкой 406.
+        Суммы ингредиентов берутся из заранее посчитанной таблицы
+        «ShoppingCartIngredient», а строки отдаются потоком.
+        """
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=request.user
         ).values(
-            ingredients=F('ingredient__name'),
-            measurement=F('ingredient__measurement_unit')
-        ).annotate(
-            amount=Sum('amount'), recept=F('recipe__name')
+            'amount',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).order_by('name').iterator()
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
-
-        purchases = list()
-        for ingredient in ingredients:
-            purchases += (
-                f'{ingredient["ingredients"]}: '
-                f'{ingredient["amount"]} {ingredient["measurement"]}\n'
-            )
-        response = HttpResponse(purchases, content_type='text.txt')
-        filename = 'Spisok_pokupok.txt'
+        filename = f'Spisok_pokupok.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
@@ -5,3 +5,8 @@ MAX_LENGTH_TEXTFIELD = 2000
 MIN_VALUE_INTEGERFIELD = 1
 MAX_LENGTH_EMAILFIELD = 254
 MAX_LENGTH_ROLE_USER = 5
+AUTOCOMPLETE_LIMIT = 20
+MAX_AUTOCOMPLETE_LIMIT = 100
+MAX_MATCH_INGREDIENTS = 100
+RECOMMENDATIONS_TOP_K = 20
+RECOMMENDATIONS_MAX_USER_RECIPES = 500
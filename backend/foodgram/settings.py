@@ -32,6 +32,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,10 +71,55 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'password'),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        # Время жизни соединения в секундах(0 - новое на каждый запрос).
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        # PgBouncer в режиме transaction не поддерживает серверные курсоры.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER', 'False') == 'True',
+        # Для SQLite тестовая БД по умолчанию в памяти, а её соединение
+        # никогда не закрывается: тестам соединений нужен файл.
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME')},
+    }
+}
+# Реплики для чтения в GET запросах(см. api.routers): хосты через запятую,
+# для SQLite - пути к файлам БД.
+DB_REPLICA_HOSTS = [
+    host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',')
+    if host.strip()
+]
+for number, host in enumerate(DB_REPLICA_HOSTS, 1):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'NAME' if 'sqlite3' in DATABASES['default']['ENGINE'] else 'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter'] if DB_REPLICA_HOSTS else []
+# Сколько секунд после изменений юзер читает из основной БД.
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+# Проверка постоянных соединений в начале запроса(см. api.connections).
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+
+# Для нескольких воркеров нужен общий бэкенд(например FileBasedCache или
+# memcached): от него зависят сброс кешей токенов и справочников во всех
+# процессах, версия индекса подбора рецептов и закрепление юзера за
+# основной БД при репликах(с LocMemCache реплики не запускаются).
+# LocMemCache подходит только для одного процесса.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
     }
 }
 
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+CATALOG_CACHE_LRU_SIZE = int(os.getenv('CATALOG_CACHE_LRU_SIZE', 256))
+# 0 - связи юзера кешируются только в пределах запроса.
+USER_RELATIONS_CACHE_TIMEOUT = int(
+    os.getenv('USER_RELATIONS_CACHE_TIMEOUT', 0)
+)
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -110,11 +157,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.paginations.PageNumberLimitPagination',
     'PAGE_SIZE': 6
 }
+# Общий уровень(SHARED) включается только с общим бэкендом кеша.
+AUTH_TOKEN_CACHE = {
+    'LOCAL_TTL': int(os.getenv('AUTH_TOKEN_CACHE_LOCAL_TTL', 5)),
+    'LOCAL_SIZE': int(os.getenv('AUTH_TOKEN_CACHE_LOCAL_SIZE', 1024)),
+    'SHARED': os.getenv('AUTH_TOKEN_CACHE_SHARED', 'True') == 'True',
+    'SHARED_TTL': int(os.getenv('AUTH_TOKEN_CACHE_SHARED_TTL', 300)),
+}
+# Под ASGI(foodgram.asgi) списки рецептов, тегов и ингредиентов
+# обслуживаются асинхронными обёртками, синхронный код выполняется в пуле
+# из ASGI_THREADS потоков(каждый держит своё соединение с БД). Остальные
+# вьюхи, а при включённых профилировании или репликах - все запросы,
+# проходят через синхронные middleware и выполняются Django в одном
+# потоке воркера по очереди.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 8))
+
+# Профилирование запросов: заголовок Server-Timing, лог медленных
+# запросов и повторяющихся SQL, метрики на «/api/metrics/».
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'False') == 'True',
+    'SLOW_REQUEST_MS': int(os.getenv('PROFILING_SLOW_REQUEST_MS', 500)),
+    'DUPLICATE_QUERY_THRESHOLD': int(
+        os.getenv('PROFILING_DUPLICATE_QUERY_THRESHOLD', 5)
+    ),
+}
 
 DJOSER = {
     'LOGIN_FIELD': 'email',
@@ -136,3 +208,5 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static_web')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
@@ -1,7 +1,11 @@
 from django.contrib.admin import ModelAdmin, TabularInline, register
 from django.utils.safestring import mark_safe
 
-from .models import Ingredient, QuantityOfIngredients, Recipe, Tag
+from .images import schedule_variants
+from .matching import ingredient_index
+from .models import (Ingredient, QuantityOfIngredients, Recipe,
+                     ShoppingCartIngredient, Tag)
+from .search import update_search_vector
 
 ModelAdmin.empty_value_display = '-пусто-'
 
@@ -36,22 +40,49 @@ class RecipeAdmin(ModelAdmin):
         ('name', 'cooking_time'), 'author', 'tag',
         'text', 'image', 'preview'
     )
-    search_fields = ('name', 'author')
-    list_filter = ('author__username', 'name', 'tag__name')
+    search_fields = ('name', 'author__username')
+    list_filter = ('tag__name',)
+    list_select_related = ('author',)
+    show_full_result_count = False
     readonly_fields = ('preview',)
     raw_id_fields = ('author',)
     inlines = (QuantityOfIngredientsInline,)
     filter_horizontal = ('tag',)
 
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.image_variants = {}
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_variants(obj)
+
+    def save_related(self, request, form, formsets, change):
+        """Переносит изменения состава рецепта в списки покупок и индексы."""
+        recipe = form.instance
+        old_amounts = dict(
+            recipe.ingredients.values_list('ingredient_id', 'amount')
+        )
+        super().save_related(request, form, formsets, change)
+        new_amounts = dict(
+            recipe.ingredients.values_list('ingredient_id', 'amount')
+        )
+        ShoppingCartIngredient.objects.change_recipe(
+            recipe, old_amounts, new_amounts
+        )
+        ingredient_index.update_on_commit(recipe.pk, new_amounts)
+        update_search_vector(recipe)
+
     def preview(self, obj):
         return mark_safe(
             f'<img src="{obj.image.url}" style="max-height: 200px">'
         )
 
     def cnt_fav(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
     cnt_fav.short_description = 'В избранном'
+    cnt_fav.admin_order_field = 'favorites_count'
 
     def cnt_shop(self, obj):
-        return obj.purchase.count()
+        return obj.in_carts_count
     cnt_shop.short_description = 'В корзине'
+    cnt_shop.admin_order_field = 'in_carts_count'
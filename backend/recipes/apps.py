@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import create_postgres_indexes
+        post_migrate.connect(create_postgres_indexes, sender=self)
@@ -0,0 +1,106 @@
+"""Поля сериализаторов для фотографий рецептов."""
+import base64
+import binascii
+import hashlib
+import uuid
+
+from api.profiling import timed
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from PIL import Image
+from rest_framework.serializers import ImageField, ValidationError
+
+from .images import get_variant_key
+
+
+class ImageVariantField(ImageField):
+    """Отдаёт ссылку на подходящий вариант фотографии рецепта.
+
+    variant: «list» или «detail»; по умолчанию «list» для действий вьюсета
+    без pk в адресе(«list», «search», «match» и т.д.) и «detail» для
+    остальных. С «webp=True» отдаётся WebP-вариант(или None, пока он не
+    готов).
+    """
+    def __init__(self, *args, variant=None, webp=False, **kwargs):
+        self.variant = variant
+        self.webp = webp
+        super().__init__(*args, **kwargs)
+
+    def get_variant(self):
+        if self.variant:
+            return self.variant
+        view = self.context.get('view')
+        return 'detail' if getattr(view, 'detail', True) else 'list'
+
+    def to_representation(self, file):
+        if not file:
+            return None
+        variants = getattr(file.instance, 'image_variants', None) or {}
+        key = get_variant_key(
+            self.get_variant(), 'webp' if self.webp else 'jpg'
+        )
+        name = variants.get(key)
+        if name is None:
+            if self.webp:
+                return None
+            name = file.name
+        url = file.storage.url(name)
+        request = self.context.get('request')
+        if request is None:
+            return url
+        return request.build_absolute_uri(url)
+
+
+class Base64ImageField(ImageVariantField):
+    """Принимает фотографию в base64(с заголовком data:URI или без).
+
+    Декодирует данные порциями во временный файл, не создавая в памяти
+    копию картинки целиком, и по ходу считает sha256 содержимого
+    (атрибут «content_hash» у файла).
+    """
+    ALLOWED_TYPES = ('jpeg', 'png', 'gif', 'webp')
+    CHUNK_SIZE = 64 * 1024
+    EMPTY_VALUES = (None, '', [], (), {})
+
+    def decode(self, payload):
+        file = TemporaryUploadedFile('image', None, 0, None)
+        digest = hashlib.sha256()
+        # Порции должны быть кратны 4 символам base64, поэтому пробелы и
+        # переводы строк(base64 с переносами) убираются заранее.
+        payload = ''.join(payload.split())
+        try:
+            for start in range(0, len(payload), self.CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    payload[start:start + self.CHUNK_SIZE], validate=True
+                )
+                digest.update(chunk)
+                file.write(chunk)
+        except (TypeError, binascii.Error, ValueError):
+            file.close()
+            raise ValidationError('Загрузите корректное изображение.')
+        file.size = file.tell()
+        file.seek(0)
+        file.content_hash = digest.hexdigest()
+        return file
+
+    def get_file_name(self, file):
+        return str(uuid.uuid4())
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise ValidationError('Изображение должно быть строкой base64.')
+        with timed('base64_image'):
+            file = self.decode(data.rpartition(';base64,')[2])
+            try:
+                image_format = Image.open(file).format.lower()
+            except (OSError, AttributeError):
+                image_format = None
+        if image_format not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError('Не удалось определить тип изображения.')
+        file.seek(0)
+        extension = 'jpg' if image_format == 'jpeg' else image_format
+        file.name = f'{self.get_file_name(file)}.{extension}'
+        file.content_type = Image.MIME.get(image_format.upper())
+        return super().to_internal_value(file)
@@ -0,0 +1,98 @@
+"""Конвейер обработки фотографий рецептов.
+
+После сохранения рецепта с новой фотографией в фоне(пул потоков)
+готовятся уменьшенные копии для списка и для страницы рецепта, каждая в
+JPEG и WebP. Пути к ним сохраняются в «Recipe.image_variants», пока их нет -
+сериализаторы отдают оригинал. При «IMAGE_PIPELINE_WORKERS = 0» обработка
+выполняется сразу в текущем потоке(удобно для тестов и отладки).
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'list': (480, 480),
+    'detail': (1200, 1200),
+}
+VARIANT_FORMATS = {
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+VARIANTS_DIR = 'recipes/variants/'
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_PIPELINE_WORKERS,
+        thread_name_prefix='recipe-images'
+    )
+
+
+def get_variant_key(variant, extension):
+    """Ключ в «Recipe.image_variants», например «list» или «list_webp»."""
+    return variant if extension == 'jpg' else f'{variant}_{extension}'
+
+
+def render_variants(image_file, name):
+    """Готовит и сохраняет все варианты фотографии, возвращает их пути."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    storage = image_file.storage
+    variants = {}
+    with storage.open(name) as source:
+        original = Image.open(source)
+        original.load()
+    if original.mode not in ('RGB', 'L'):
+        original = original.convert('RGB')
+    for variant, size in VARIANT_SIZES.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        for extension, (image_format, options) in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            variants[get_variant_key(variant, extension)] = storage.save(
+                f'{VARIANTS_DIR}{stem}_{variant}.{extension}',
+                ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def build_variants(recipe_id, name):
+    """Задача конвейера: варианты фотографии «name» рецепта «recipe_id»."""
+    try:
+        recipe = Recipe.objects.only('image').get(pk=recipe_id)
+        if recipe.image.name != name:
+            return
+        variants = render_variants(recipe.image, name)
+        # Новая дата изменения меняет ETag: клиенты получат уменьшенные копии.
+        Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants, updated_at=timezone.now()
+        )
+    except Exception:
+        logger.exception(f'Не удалось обработать фотографию {name}')
+    finally:
+        if settings.IMAGE_PIPELINE_WORKERS:
+            connections.close_all()
+
+
+def schedule_variants(recipe):
+    """Ставит обработку фотографии рецепта в очередь после коммита."""
+    name = recipe.image.name
+    if settings.IMAGE_PIPELINE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(build_variants, recipe.pk, name)
+        )
+    else:
+        transaction.on_commit(lambda: build_variants(recipe.pk, name))
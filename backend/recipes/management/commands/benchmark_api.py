@@ -0,0 +1,276 @@
+"""Management команда для нагрузочного замера горячих эндпоинтов API.
+
+По команде «python manage.py benchmark_api --seed» заполняет БД тестовыми
+юзерами, рецептами, ингредиентами рецептов, избранным, корзинами и
+подписками(все имена с префиксом «bench_»), а затем для каждого
+эндпоинта замеряет задержку(p50/p95/p99), пропускную способность и
+количество запросов к БД. Если количество запросов превышает бюджет
+эндпоинта(«ENDPOINTS»), команда завершается с ошибкой, поэтому её можно
+запускать в CI:
+
+    python manage.py benchmark_api --seed --users 50 --recipes 500
+    python manage.py benchmark_api --requests 200
+    python manage.py benchmark_api --cleanup
+
+Запросы идут через тестовый клиент DRF в том же процессе, с
+авторизацией по токену. Перед замером выполняются прогревочные запросы,
+поэтому бюджеты описывают установившийся режим(с прогретыми кешами).
+Адреса с «{number}» получают номер запроса, так что каждый запрос
+отличается и не попадает в кеш ответов.
+"""
+import io
+import itertools
+import logging
+import math
+import random
+import time
+
+from api.cache import ingredients_cache, tags_cache
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from recipes.matching import ingredient_index
+from recipes.models import (Ingredient, QuantityOfIngredients, Recipe,
+                            ShoppingCartIngredient, Tag)
+from recipes.search import prefix_index, recipe_index
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+PREFIX = 'bench_'
+BATCH_SIZE = 5000
+PERCENTILES = (50, 95, 99)
+# Имя, адрес и бюджет запросов к БД на один запрос к API.
+ENDPOINTS = (
+    ('recipes_list', '/api/recipes/', 6),
+    ('recipes_list_cursor', '/api/recipes/?pagination=cursor', 5),
+    ('recipes_popular', '/api/recipes/?ordering=popular', 6),
+    ('recipe_detail', '/api/recipes/{recipe}/', 5),
+    ('is_favorited', '/api/recipes/?is_favorited=1', 6),
+    ('is_in_shopping_cart', '/api/recipes/?is_in_shopping_cart=1', 6),
+    ('subscriptions', '/api/users/subscriptions/?recipes_limit=3', 3),
+    ('download_shopping_cart', '/api/recipes/download_shopping_cart/', 1),
+    ('ingredients_search', '/api/ingredients/?name={ingredient}{number}', 1),
+    ('ingredients_search_cached', '/api/ingredients/?name={ingredient}', 0),
+)
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга(values отсортирован)."""
+    rank = math.ceil(percent / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+
+def bulk_create(model, objects, **kwargs):
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE, **kwargs)
+
+
+def create_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 400), 'orange').save(buffer, 'JPEG')
+    storage = Recipe._meta.get_field('image').storage
+    return storage.save(f'recipes/{PREFIX}image.jpg', ContentFile(
+        buffer.getvalue()
+    ))
+
+
+class Command(BaseCommand):
+    help = 'Замеряем задержку и запросы к БД для горячих эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', action='store_true',
+            help='Заполнить БД тестовыми данными перед замером'
+        )
+        parser.add_argument(
+            '--cleanup', action='store_true',
+            help='Удалить тестовые данные и выйти'
+        )
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Количество замеряемых запросов на эндпоинт'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Количество прогревочных запросов на эндпоинт'
+        )
+        parser.add_argument(
+            '--no-budgets', action='store_true',
+            help='Не проверять бюджеты запросов к БД'
+        )
+
+    def cleanup(self):
+        CustomUser.objects.filter(username__startswith=PREFIX).delete()
+        Ingredient.objects.filter(name__startswith=PREFIX).delete()
+        Tag.objects.filter(slug__startswith=PREFIX).delete()
+        self.invalidate()
+
+    def invalidate(self):
+        for index in (prefix_index, recipe_index, ingredient_index):
+            index.invalidate()
+        for cache in (tags_cache, ingredients_cache):
+            cache.invalidate()
+
+    def seed(self, options):
+        rng = random.Random(0)
+        bulk_create(CustomUser, (
+            CustomUser(
+                username=f'{PREFIX}{number}',
+                email=f'{PREFIX}{number}@example.com',
+                first_name='Bench', last_name=str(number),
+                password='!'
+            ) for number in range(options['users'])
+        ))
+        users = list(
+            CustomUser.objects.filter(username__startswith=PREFIX)
+            .values_list('id', flat=True)
+        )
+        bulk_create(Ingredient, (
+            Ingredient(name=f'{PREFIX}ингредиент {number}',
+                       measurement_unit='г')
+            for number in range(options['ingredients'])
+        ))
+        ingredients = list(
+            Ingredient.objects.filter(name__startswith=PREFIX)
+            .values_list('id', flat=True)
+        )
+        bulk_create(Tag, (
+            Tag(name=f'{PREFIX}{number}', color=f'#00000{number}',
+                slug=f'{PREFIX}{number}')
+            for number in range(3)
+        ))
+        tags = list(
+            Tag.objects.filter(slug__startswith=PREFIX)
+            .values_list('id', flat=True)
+        )
+        image = create_image()
+        bulk_create(Recipe, (
+            Recipe(
+                author_id=rng.choice(users), name=f'{PREFIX}рецепт {number}',
+                text='Тестовый рецепт для замеров', image=image,
+                cooking_time=rng.randint(1, 120)
+            ) for number in range(options['recipes'])
+        ))
+        recipes = list(
+            Recipe.objects.filter(author_id__in=users)
+            .values_list('id', flat=True)
+        )
+        per_recipe = min(options['ingredients_per_recipe'], len(ingredients))
+        bulk_create(QuantityOfIngredients, (
+            QuantityOfIngredients(
+                recipe_id=recipe, ingredient_id=ingredient,
+                amount=rng.randint(1, 500)
+            )
+            for recipe in recipes
+            for ingredient in rng.sample(ingredients, per_recipe)
+        ))
+        bulk_create(Recipe.tag.through, (
+            Recipe.tag.through(recipe_id=recipe, tag_id=rng.choice(tags))
+            for recipe in recipes
+        ))
+        for through, per_user in (
+            (Recipe.favorite.through, options['favorites_per_user']),
+            (Recipe.purchase.through, options['carts_per_user'])
+        ):
+            bulk_create(through, (
+                through(customuser_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in rng.sample(recipes, min(per_user, len(recipes)))
+            ), ignore_conflicts=True)
+        subscriber = CustomUser.subscriber.through
+        bulk_create(subscriber, (
+            subscriber(from_customuser_id=author, to_customuser_id=user)
+            for user in users
+            for author in rng.sample(
+                users, min(options['subscriptions_per_user'], len(users))
+            ) if author != user
+        ), ignore_conflicts=True)
+        ShoppingCartIngredient.objects.rebuild(users)
+        Recipe.objects.filter(author_id__in=users).sync_counters()
+        self.invalidate()
+        logging.info(
+            f'Создано юзеров: {len(users)}, рецептов: {len(recipes)}, '
+            f'ингредиентов: {len(ingredients)}'
+        )
+
+    def get_client(self):
+        user = CustomUser.objects.filter(
+            username__startswith=PREFIX
+        ).order_by('id').first()
+        if user is None:
+            raise CommandError(
+                'Нет тестовых данных, запустите команду с флагом «--seed»'
+            )
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def measure(self, client, url, params, options):
+        """Список задержек(в секундах) и максимум запросов к БД."""
+        numbers = itertools.count()
+        for _ in range(options['warmup']):
+            self.request(client, url.format(number=next(numbers), **params))
+        timings, queries = [], 0
+        for _ in range(options['requests']):
+            request_url = url.format(number=next(numbers), **params)
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.request(client, request_url)
+                timings.append(time.perf_counter() - started)
+            queries = max(queries, len(context.captured_queries))
+        return timings, queries
+
+    def request(self, client, url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.cleanup()
+            logging.info('Тестовые данные удалены')
+            return
+        if options['seed']:
+            self.cleanup()
+            self.seed(options)
+        client = self.get_client()
+        params = {
+            'recipe': Recipe.objects.filter(
+                author__username__startswith=PREFIX
+            ).values_list('id', flat=True).first(),
+            'ingredient': f'{PREFIX}ингредиент ',
+        }
+        over_budget = []
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, url, budget in ENDPOINTS:
+                timings, queries = self.measure(client, url, params, options)
+                timings.sort()
+                latencies = ', '.join(
+                    f'p{percent} {percentile(timings, percent) * 1000:.1f}'
+                    for percent in PERCENTILES
+                )
+                logging.info(
+                    f'{name}: {latencies} мс, '
+                    f'{len(timings) / sum(timings):.0f} запр./с, '
+                    f'запросов к БД: {queries}(бюджет {budget})'
+                )
+                if queries > budget:
+                    over_budget.append(f'{name}({queries} > {budget})')
+        if over_budget and not options['no_budgets']:
+            raise CommandError(
+                f'Превышен бюджет запросов к БД: {", ".join(over_budget)}'
+            )
@@ -0,0 +1,134 @@
+"""Management команда для сравнения WSGI и ASGI под конкурентной нагрузкой.
+
+Отправляет запросы к уже запущенному серверу по HTTP из «--concurrency»
+потоков и выводит задержку(p50/p95/p99), пропускную способность и
+количество ошибок для каждого адреса. Для сравнения режимов один и тот же
+замер запускается против обоих серверов:
+
+    SERVER_MODE=wsgi GUNICORN_WORKERS=4 ...   # сервер на :8000
+    python manage.py benchmark_http http://127.0.0.1:8000 -c 200
+    SERVER_MODE=asgi GUNICORN_WORKERS=4 ...   # сервер на :8001
+    python manage.py benchmark_http http://127.0.0.1:8001 -c 200
+
+Флаг «--slow-clients N» дополнительно держит N соединений, которые
+медленно отправляют тело запроса(как клиенты на плохой сети с большой
+фотографией), и показывает, как это влияет на остальные запросы.
+"""
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+from .benchmark_api import PERCENTILES, percentile
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+DEFAULT_PATHS = (
+    '/api/recipes/', '/api/tags/', '/api/ingredients/?name=%D1%81'
+)
+SLOW_BODY_SIZE = 1024 * 1024
+SLOW_CHUNK_SIZE = 1024
+SLOW_CHUNK_DELAY = 0.05
+
+
+def fetch(url, headers, timeout):
+    """Время ответа в секундах или None при ошибке."""
+    started = time.perf_counter()
+    try:
+        with urlopen(Request(url, headers=headers), timeout=timeout) as resp:
+            resp.read()
+    except (HTTPError, URLError, OSError):
+        return None
+    return time.perf_counter() - started
+
+
+def slow_client(base_url, stop):
+    """Медленно отправляет большое тело POST-запроса, пока не «stop»."""
+    parts = urlsplit(base_url)
+    while not stop.is_set():
+        try:
+            with socket.create_connection(
+                (parts.hostname, parts.port or 80), timeout=30
+            ) as sock:
+                sock.sendall((
+                    'POST /api/recipes/ HTTP/1.1\r\n'
+                    f'Host: {parts.netloc}\r\n'
+                    'Content-Type: application/json\r\n'
+                    f'Content-Length: {SLOW_BODY_SIZE}\r\n\r\n'
+                ).encode())
+                for _ in range(SLOW_BODY_SIZE // SLOW_CHUNK_SIZE):
+                    if stop.is_set():
+                        return
+                    sock.sendall(b' ' * SLOW_CHUNK_SIZE)
+                    time.sleep(SLOW_CHUNK_DELAY)
+        except OSError:
+            time.sleep(SLOW_CHUNK_DELAY)
+
+
+class Command(BaseCommand):
+    help = 'Замеряем задержку и пропускную способность сервера по HTTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='Например http://127.0.0.1:8000')
+        parser.add_argument(
+            '--path', action='append',
+            help='Адрес для замера(можно несколько раз)'
+        )
+        parser.add_argument('-c', '--concurrency', type=int, default=100)
+        parser.add_argument(
+            '-n', '--requests', type=int, default=2000,
+            help='Количество запросов на адрес'
+        )
+        parser.add_argument('--token', help='Токен для авторизации')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help='Сколько медленных клиентов держать во время замера'
+        )
+
+    def measure(self, url, options, headers):
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            started = time.perf_counter()
+            results = list(executor.map(
+                lambda _: fetch(url, headers, options['timeout']),
+                range(options['requests'])
+            ))
+            elapsed = time.perf_counter() - started
+        timings = sorted(result for result in results if result is not None)
+        errors = len(results) - len(timings)
+        if not timings:
+            logging.info(f'{url}: все {errors} запросов завершились ошибкой')
+            return
+        latencies = ', '.join(
+            f'p{percent} {percentile(timings, percent) * 1000:.1f}'
+            for percent in PERCENTILES
+        )
+        logging.info(
+            f'{url}: {latencies} мс, {len(timings) / elapsed:.0f} запр./с, '
+            f'ошибок: {errors}'
+        )
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        stop = threading.Event()
+        slow_clients = [
+            threading.Thread(
+                target=slow_client, args=(base_url, stop), daemon=True
+            ) for _ in range(options['slow_clients'])
+        ]
+        for thread in slow_clients:
+            thread.start()
+        try:
+            for path in options['path'] or DEFAULT_PATHS:
+                self.measure(f'{base_url}{path}', options, headers)
+        finally:
+            stop.set()
@@ -0,0 +1,108 @@
+"""Management команда для построения рекомендаций рецептов.
+
+По команде «python manage.py build_recommendations» считает похожие
+рецепты по избранному и спискам покупок юзеров и заполняет таблицу
+«RecipeSimilarity». Инкрементальный пересчёт:
+
+    python manage.py build_recommendations --recipe 12 --recipe 15
+    python manage.py build_recommendations --since-minutes 60
+
+Второй вариант пересчитывает рецепты юзеров, у которых изменилось
+избранное или корзина(по «CustomUser.relations_updated_at»), и рецепты,
+которые добавили или убрали из избранного и корзин(по
+«Recipe.relations_updated_at»): убранный рецепт уже не связан с юзером,
+но его похожие рецепты тоже устарели.
+С флагом «--benchmark N» замеряет построение на N синтетических
+отметках без записи в БД.
+"""
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from foodgram.constants import RECOMMENDATIONS_TOP_K
+from recipes.models import Recipe
+from recipes.recommendations import Interactions, build_similarities
+from users.models import CustomUser
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+BENCHMARK_USERS_RATIO = 20
+BENCHMARK_RECIPES_RATIO = 50
+
+
+def generate_pairs(size):
+    """Синтетические отметки: популярные рецепты отмечают чаще."""
+    rng = random.Random(size)
+    users = max(size // BENCHMARK_USERS_RATIO, 1)
+    recipes = max(size // BENCHMARK_RECIPES_RATIO, 1)
+    for _ in range(size):
+        yield rng.randint(1, users), int(recipes * rng.random() ** 2) + 1
+
+
+class Command(BaseCommand):
+    help = 'Строим таблицу похожих рецептов для рекомендаций'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=RECOMMENDATIONS_TOP_K,
+            help='Сколько похожих рецептов хранить для каждого'
+        )
+        parser.add_argument(
+            '--recipe', type=int, action='append',
+            help='Пересчитать только указанные рецепты'
+        )
+        parser.add_argument(
+            '--since-minutes', type=int,
+            help='Пересчитать рецепты юзеров, изменивших отметки за N минут'
+        )
+        parser.add_argument(
+            '--benchmark', type=int, metavar='N',
+            help='Замерить построение на N синтетических отметках'
+        )
+
+    def benchmark(self, size, top_k):
+        started = time.perf_counter()
+        interactions = Interactions(generate_pairs(size))
+        loaded = time.perf_counter()
+        rows = sum(
+            len(interactions.get_similar(recipe, top_k))
+            for recipe in interactions.recipes
+        )
+        finished = time.perf_counter()
+        logging.info(
+            f'Отметок: {size}, юзеров: {len(interactions.users)}, '
+            f'рецептов: {len(interactions.recipes)}'
+        )
+        logging.info(f'Загрузка матрицы: {loaded - started:.2f} c')
+        logging.info(
+            f'Похожие рецепты: {finished - loaded:.2f} c, строк: {rows}'
+        )
+
+    def handle(self, *args, **options):
+        top_k = options['top_k']
+        if options['benchmark']:
+            self.benchmark(options['benchmark'], top_k)
+            return
+        interactions = Interactions.load()
+        recipes = None
+        if options['recipe']:
+            recipes = set(options['recipe'])
+        if options['since_minutes'] is not None:
+            since = timezone.now() - timedelta(
+                minutes=options['since_minutes']
+            )
+            users = CustomUser.objects.filter(
+                relations_updated_at__gte=since
+            ).values_list('id', flat=True)
+            changed = Recipe.objects.filter(
+                relations_updated_at__gte=since
+            ).values_list('id', flat=True)
+            recipes = (
+                (recipes or set()) | interactions.get_affected(users)
+                | set(changed)
+            )
+        rows = build_similarities(interactions, recipes, top_k)
+        logging.info(f'Записано похожих рецептов: {rows}')
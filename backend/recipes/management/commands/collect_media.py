@@ -0,0 +1,75 @@
+"""Management команда для удаления неиспользуемых фотографий рецептов.
+
+По команде «python manage.py collect_media» находит в каталоге «recipes/»
+хранилища файлы, на которые не ссылается ни один рецепт(ни как на
+оригинал, ни как на уменьшенную копию), и удаляет их. Свежие файлы
+(моложе «--min-age» минут) не трогаются, чтобы не удалить фотографию
+рецепта, который ещё сохраняется.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.models import Recipe
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+MEDIA_DIR = 'recipes'
+MIN_AGE_MINUTES = 60
+
+
+def walk(storage, directory):
+    directories, files = storage.listdir(directory)
+    for file in files:
+        yield os.path.join(directory, file)
+    for subdirectory in directories:
+        yield from walk(storage, os.path.join(directory, subdirectory))
+
+
+def count_references():
+    """Количество ссылок из рецептов на каждый файл."""
+    references = {}
+    rows = Recipe.objects.values_list('image', 'image_variants').iterator()
+    for image, variants in rows:
+        for name in (image, *(variants or {}).values()):
+            references[name] = references.get(name, 0) + 1
+    return references
+
+
+class Command(BaseCommand):
+    help = 'Удаляем фотографии, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать файлы, которые будут удалены'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=MIN_AGE_MINUTES,
+            help='Не удалять файлы моложе указанного числа минут'
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        if not storage.exists(MEDIA_DIR):
+            logging.info('Каталог с фотографиями пуст')
+            return
+        references = count_references()
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = shared = 0
+        for name in walk(storage, MEDIA_DIR):
+            if references.get(name, 0) > 1:
+                shared += 1
+            if name in references:
+                continue
+            if storage.get_modified_time(name) > threshold:
+                continue
+            if options['dry_run']:
+                logging.info(f'Будет удалён файл {name}')
+            else:
+                storage.delete(name)
+            removed += 1
+        logging.info(f'Файлов без ссылок: {removed}')
+        logging.info(f'Файлов, общих для нескольких рецептов: {shared}')
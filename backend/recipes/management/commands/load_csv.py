@@ -1,37 +1,149 @@
-"""Management команда для загрузки ингридиентов в БД из csv файла.
+"""Management команда для загрузки ингридиентов в БД из csv/json файлов.
 
 По команде «python manage.py load_csv» загружает в БД названия и
 единицы измерения ингредиентов, для модели «Ingredient», из
-подготовленного csv файла.
+подготовленного csv файла. Дополнительно можно передать свои файлы или
+шаблоны путей(относительно BASE_DIR):
+
+    python manage.py load_csv data/*.json db.json
+
+Поддерживаются csv с колонками «name,measurement_unit», json-список
+объектов с теми же ключами и фикстуры Django(берутся только записи
+модели «recipes.ingredient»). Данные читаются порциями и вставляются
+пачками, уже существующие ингредиенты пропускаются, поэтому команду
+можно запускать повторно для дозагрузки справочника. В PostgreSQL
+каждая порция загружается через «COPY» во временную таблицу и переносится
+в основную одним «INSERT ... ON CONFLICT DO NOTHING».
 """
 import csv
+import glob
+import io
+import json
 import logging
 import os
+from itertools import islice
 
+from api.cache import ingredients_cache
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from django.db import IntegrityError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from recipes.models import Ingredient
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
-models = {
-    'ingredients.csv': Ingredient,
+DEFAULT_FILES = ('data/ingredients.csv',)
+FIELDS = ('name', 'measurement_unit')
+FIXTURE_MODEL = 'recipes.ingredient'
+CHUNK_SIZE = 5000
+
+
+def read_csv(file):
+    with open(file, encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def read_json(file):
+    with open(file, encoding='utf-8') as f:
+        data = json.load(f)
+    for row in data:
+        if 'model' in row:
+            if row['model'] != FIXTURE_MODEL:
+                continue
+            row = row['fields']
+        yield row
+
+
+readers = {
+    '.csv': read_csv,
+    '.json': read_json,
 }
 
 
+def read_rows(file):
+    """Строки (name, measurement_unit) из файла, без пустых значений."""
+    reader = readers.get(os.path.splitext(file)[1].lower())
+    if reader is None:
+        raise CommandError(f'Неподдерживаемый формат файла: {file}')
+    for row in reader(file):
+        values = tuple(str(row.get(field) or '').strip() for field in FIELDS)
+        if all(values):
+            yield values
+
+
+def insert_bulk(rows):
+    Ingredient.objects.bulk_create(
+        (Ingredient(**dict(zip(FIELDS, row))) for row in rows),
+        ignore_conflicts=True
+    )
+
+
+def insert_copy(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    table = Ingredient._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE ingredient_staging '
+            '(name varchar, measurement_unit varchar) ON COMMIT DROP'
+        )
+        cursor.copy_expert(
+            'COPY ingredient_staging (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT DISTINCT name, measurement_unit FROM ingredient_staging '
+            'ON CONFLICT (name, measurement_unit) DO NOTHING'
+        )
+
+
 class Command(BaseCommand):
-    help = 'Загружаем данные в БД из csv'
+    help = 'Загружаем данные в БД из csv/json'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*', default=DEFAULT_FILES,
+            help='Файлы или шаблоны путей относительно BASE_DIR'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Количество строк в одной порции'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY даже в PostgreSQL'
+        )
+
+    def get_files(self, patterns):
+        files = []
+        for pattern in patterns:
+            matched = sorted(
+                glob.glob(os.path.join(settings.BASE_DIR, pattern))
+            )
+            if not matched:
+                raise CommandError(f'Файлы не найдены: {pattern}')
+            files.extend(matched)
+        return files
 
     def handle(self, *args, **options):
-        for csv_key, model in models.items():
-            file = os.path.join(settings.BASE_DIR, f'data/{csv_key}')
-            with open(file, encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                try:
-                    for row in reader:
-                        model.objects.create(**row)
-                except IntegrityError:
-                    logging.warning('Данные уже загружены')
+        insert = insert_bulk
+        if connection.vendor == 'postgresql' and not options['no_copy']:
+            insert = insert_copy
+        before = Ingredient.objects.count()
+        for file in self.get_files(options['files']):
+            rows = read_rows(file)
+            processed = 0
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
                     break
-            logging.info(f'Данные из файла {csv_key} успешно загружены')
+                insert(chunk)
+                processed += len(chunk)
+                logging.info(f'{file}: обработано строк - {processed}')
+            logging.info(f'Данные из файла {file} успешно загружены')
+        added = Ingredient.objects.count() - before
+        if added:
+            ingredients_cache.invalidate()
+        logging.info(f'Добавлено новых ингредиентов: {added}')
@@ -0,0 +1,36 @@
+"""Management команда для пересчёта поисковых векторов рецептов.
+
+По команде «python manage.py rebuild_search_index» заново заполняет поле
+«Recipe.search_vector» у всех рецептов, например после первой миграции
+или переименования ингредиентов. Вне PostgreSQL увеличивает общую версию
+индексов поиска рецептов и автодополнения ингредиентов: все процессы
+приложения, работающие с тем же общим кешем, построят их заново при
+следующем запросе.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from recipes.models import Recipe
+from recipes.search import prefix_index, recipe_index, update_search_vector
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитываем поисковые векторы рецептов(вне PostgreSQL - '
+        'сбрасываем индексы поиска во всех процессах с общим кешем)'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            recipe_index.invalidate()
+            prefix_index.invalidate()
+            logging.info('Индексы поиска будут построены при первом запросе')
+            return
+        updated = 0
+        for recipe in Recipe.objects.only('id', 'name', 'text').iterator():
+            update_search_vector(recipe)
+            updated += 1
+        logging.info(f'Обновлено поисковых векторов: {updated}')
@@ -0,0 +1,46 @@
+"""Management команда для пересчёта списков покупок.
+
+По команде «python manage.py rebuild_shopping_carts» заново заполняет
+таблицу «ShoppingCartIngredient» по рецептам в корзинах юзеров и сверяет
+результат с живым агрегатом. С флагом «--check» только сверяет данные.
+"""
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import ShoppingCartIngredient
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+
+def find_mismatches():
+    """Ключи (user_id, ingredient_id), где таблица расходится с агрегатом."""
+    live = ShoppingCartIngredient.objects.live_totals()
+    stored = {
+        (user, ingredient): amount
+        for user, ingredient, amount in ShoppingCartIngredient.objects
+        .values_list('user_id', 'ingredient_id', 'amount').iterator()
+    }
+    return [
+        key for key in {*live, *stored} if live.get(key) != stored.get(key)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитываем и сверяем списки покупок юзеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сверить таблицу с живым агрегатом'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            ShoppingCartIngredient.objects.rebuild()
+            logging.info('Списки покупок пересчитаны')
+        mismatches = find_mismatches()
+        if mismatches:
+            raise CommandError(
+                f'Расхождений в списках покупок: {len(mismatches)}'
+            )
+        logging.info('Списки покупок совпадают с живым агрегатом')
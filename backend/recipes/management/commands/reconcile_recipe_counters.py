@@ -0,0 +1,39 @@
+"""Management команда для сверки счётчиков популярности рецептов.
+
+По команде «python manage.py reconcile_recipe_counters» сравнивает поля
+«favorites_count» и «in_carts_count» с количеством строк в избранном и
+списках покупок и исправляет расхождения(например, после удаления юзеров:
+каскадное удаление не отправляет сигналы M2M). С флагом «--check» только
+сверяет данные.
+"""
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+from recipes.models import Recipe
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+
+class Command(BaseCommand):
+    help = 'Сверяем и исправляем счётчики избранного и корзины у рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сверить счётчики, ничего не исправляя'
+        )
+
+    def handle(self, *args, **options):
+        stale = Recipe.objects.with_live_counts().filter(
+            ~Q(favorites_count=F('live_favorites'))
+            | ~Q(in_carts_count=F('live_in_carts'))
+        )
+        ids = list(stale.values_list('id', flat=True))
+        if not ids:
+            logging.info('Счётчики рецептов совпадают с данными')
+            return
+        if options['check']:
+            raise CommandError(f'Расхождений в счётчиках рецептов: {len(ids)}')
+        Recipe.objects.filter(id__in=ids).sync_counters()
+        logging.info(f'Исправлено счётчиков рецептов: {len(ids)}')
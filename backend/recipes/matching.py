@@ -0,0 +1,107 @@
+"""Подбор рецептов по набору ингредиентов, которые есть у юзера.
+
+Индекс в памяти процесса строится одним запросом к
+«QuantityOfIngredients»: для каждого ингредиента хранится отсортированный
+список id рецептов(posting list), для каждого рецепта - отсортированный
+список id его ингредиентов. Запрос складывает posting lists выбранных
+ингредиентов, поэтому его стоимость зависит от числа рецептов с этими
+ингредиентами, а не от общего количества рецептов.
+
+Версия индекса общая для процессов(см. «versioning»): после сохранения
+или удаления рецепта процесс обновляет свой индекс только по этому
+рецепту и увеличивает версию, остальные загружают индекс заново при
+следующем подборе.
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.db import transaction
+
+from .models import QuantityOfIngredients
+from .versioning import VersionedIndex
+
+
+def insert_sorted(ids, pk):
+    position = bisect_left(ids, pk)
+    if position == len(ids) or ids[position] != pk:
+        ids.insert(position, pk)
+
+
+def remove_sorted(ids, pk):
+    position = bisect_left(ids, pk)
+    if position < len(ids) and ids[position] == pk:
+        del ids[position]
+
+
+class RecipeIngredientIndex(VersionedIndex):
+    """Индекс «рецепт <-> ингредиенты» для ранжирования по покрытию."""
+    version_key = 'matching:version'
+
+    def reset(self):
+        self._recipes = None
+        self._postings = {}
+
+    def is_loaded(self):
+        return self._recipes is not None
+
+    def load(self):
+        recipes, postings = {}, {}
+        for recipe, ingredient in QuantityOfIngredients.objects.order_by(
+            'recipe_id', 'ingredient_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator():
+            recipes.setdefault(recipe, array('I')).append(ingredient)
+            postings.setdefault(ingredient, array('I')).append(recipe)
+        self._postings = postings
+        self._recipes = recipes
+
+    def get_recipes(self):
+        self.ensure_loaded()
+        return self._recipes
+
+    def remove_local(self, pk):
+        for ingredient in self._recipes.pop(pk, ()):
+            remove_sorted(self._postings[ingredient], pk)
+
+    def discard(self, pk):
+        if self._recipes is not None:
+            self.remove_local(pk)
+        self.bump_version()
+
+    def update(self, pk, ingredients):
+        if self._recipes is not None:
+            self.remove_local(pk)
+            self._recipes[pk] = array('I', sorted(ingredients))
+            for ingredient in ingredients:
+                insert_sorted(
+                    self._postings.setdefault(ingredient, array('I')), pk
+                )
+        self.bump_version()
+
+    def discard_on_commit(self, pk):
+        transaction.on_commit(lambda: self.discard(pk))
+
+    def update_on_commit(self, pk, ingredients):
+        ingredients = list(ingredients)
+        transaction.on_commit(lambda: self.update(pk, ingredients))
+
+    def match(self, ingredients):
+        """Список (id рецепта, совпало, всего) по убыванию покрытия.
+
+        При равном покрытии выше рецепты, где не хватает меньше
+        ингредиентов.
+        """
+        recipes = self.get_recipes()
+        matched = Counter()
+        for ingredient in set(ingredients):
+            matched.update(self._postings.get(ingredient, ()))
+        ranked = [
+            (pk, count, len(recipes[pk])) for pk, count in matched.items()
+        ]
+        ranked.sort(
+            key=lambda row: (-row[1] / row[2], row[2] - row[1], row[0])
+        )
+        return ranked
+
+
+ingredient_index = RecipeIngredientIndex()
@@ -1,21 +1,29 @@
 """Файл для проектирования и описания моделей приложения «recipes» для ORM.
 
 Модели:
-  - Ingredient(строка-19): Модель ингредиентов и их единицы измерения.
-  - Tag(строка-48): Модель тегов для рецептов.
-  - Recipe(строка-77): Основная модель приложения, для создания и
-                       описания рецептов.
-  - QuantityOfIngredients(строка-146): Промежуточная модель количества
+  - Ingredient(строка-28): Модель ингредиентов и их единицы измерения.
+  - Tag(строка-60): Модель тегов для рецептов.
+  - Recipe(строка-205): Основная модель приложения, для создания и
+                        описания рецептов.
+  - QuantityOfIngredients(строка-329): Промежуточная модель количества
                                        ингредиентов в блюде.
+  - ShoppingCartIngredient(строка-491): Суммарное количество ингредиентов
+                                        в списке покупок юзера.
+  - RecipeSimilarity(строка-530): Похожий рецепт для рекомендаций.
 """
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest, Lower
+from django.utils import timezone
 from foodgram.constants import (MAX_LENGTH_CHARFIELD, MAX_LENGTH_HEX_CODE,
                                 MAX_LENGTH_NAME_RECIPE, MAX_LENGTH_TEXTFIELD,
                                 MIN_VALUE_INTEGERFIELD)
 from users.models import CustomUser
 
+from .storage import ContentAddressedStorage
+
 
 class Ingredient(models.Model):
     """Модель ингредиентов и их единиц измерений.
@@ -39,6 +47,9 @@ class Ingredient(models.Model):
                 name='%(app_label)s_%(class)s_unique_object'
             )
         ]
+        indexes = [
+            models.Index(Lower('name'), name='recipes_ingr_lower_name_idx')
+        ]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -77,6 +88,120 @@ class Tag(models.Model):
         return self.name
 
 
+def count_relations(through):
+    """Подзапрос количества строк промежуточной таблицы M2M для рецепта."""
+    return Coalesce(
+        models.Subquery(
+            through.objects.filter(recipe=models.OuterRef('pk'))
+            .order_by().values('recipe')
+            .annotate(cnt=models.Count('pk')).values('cnt'),
+            output_field=models.IntegerField()
+        ), 0
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов для модели «Recipe»."""
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами «is_favorited» и «is_in_shopping_cart».
+
+        Флаги вычисляются подзапросами «EXISTS» в основном запросе, поэтому
+        их стоимость не зависит от количества рецептов на странице.
+        """
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Recipe.favorite.through.objects.filter(
+                    recipe=models.OuterRef('pk'), customuser=user
+                )
+            ),
+            is_in_shopping_cart=models.Exists(
+                Recipe.purchase.through.objects.filter(
+                    recipe=models.OuterRef('pk'), customuser=user
+                )
+            )
+        )
+
+    def latest_per_author(self, limit):
+        """Не больше «limit» последних рецептов каждого автора.
+
+        Используется в «Prefetch» для ленты подписок: коррелированный
+        подзапрос с LIMIT отбирает рецепты прямо в БД.
+        """
+        return self.filter(pk__in=models.Subquery(
+            Recipe.objects.filter(
+                author=models.OuterRef('author')
+            ).order_by('-pub_date', 'id').values('pk')[:limit]
+        ))
+
+    def with_live_counts(self):
+        """Аннотирует рецепты количеством отметок, посчитанным по M2M.
+
+        «live_favorites» и «live_in_carts» - коррелированные подзапросы,
+        они не перемножают join'ы двух M2M.
+        """
+        return self.annotate(
+            live_favorites=count_relations(Recipe.favorite.through),
+            live_in_carts=count_relations(Recipe.purchase.through)
+        )
+
+    def sync_counters(self):
+        """Записывает в счётчики количество отметок одним «UPDATE»."""
+        return self.update(
+            favorites_count=count_relations(Recipe.favorite.through),
+            in_carts_count=count_relations(Recipe.purchase.through)
+        )
+
+    def change_counter(self, field, deltas):
+        """Атомарно меняет счётчик «field» на величину из «deltas».
+
+        deltas: словарь вида {recipe_id: изменение}. Рецепты с одинаковым
+        изменением обновляются одним запросом «UPDATE ... SET field =
+        field + n», счётчик не опускается ниже нуля. Тем же запросом
+        обновляется «relations_updated_at», по нему пересчитываются
+        рекомендации рецептов, потерявших отметки.
+        """
+        recipes_by_delta = {}
+        for recipe, delta in deltas.items():
+            if delta:
+                recipes_by_delta.setdefault(delta, []).append(recipe)
+        for delta, recipes in recipes_by_delta.items():
+            self.filter(pk__in=recipes).update(**{
+                field: Greatest(models.F(field) + delta, 0),
+                'relations_updated_at': timezone.now()
+            })
+
+    def with_related(self, user):
+        """План загрузки всего графа рецепта для сериализатора.
+
+        Автор подгружается одним запросом вместе с флагом «is_subscribed»,
+        теги и ингредиенты(вместе с «Ingredient») - по одному запросу на
+        страницу, флаги избранного и корзины - подзапросами.
+        """
+        return self.with_user_flags(user).prefetch_related(
+            models.Prefetch(
+                'author',
+                queryset=CustomUser.objects.with_is_subscribed(user)
+            ),
+            'tag',
+            models.Prefetch(
+                'ingredients',
+                queryset=QuantityOfIngredients.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+
 class Recipe(models.Model):
     """Основная модель приложения, для создания и описания рецептов.
 
@@ -92,6 +217,16 @@ class Recipe(models.Model):
       - favorite(M2M с моделью «CustomUser»): избранные рецепты
       - purchase(M2M с моделью «CustomUser»): список покупок для
                                               выбранных рецептов
+    Служебные поля:
+      - favorites_count, in_carts_count: сколько юзеров добавили рецепт в
+                                         избранное и в список покупок
+      - relations_updated_at: дата последнего добавления или удаления
+                              рецепта из избранного и списков покупок
+      - image_variants: пути к уменьшенным копиям фотографии(JPEG и WebP)
+      - search_vector: полнотекстовый вектор названия, описания и
+                       ингредиентов(только PostgreSQL)
+      - pub_date: дата публикации
+      - updated_at: дата последнего изменения(используется для ETag)
     """
     author = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE,
@@ -101,7 +236,12 @@ class Recipe(models.Model):
         max_length=MAX_LENGTH_NAME_RECIPE, verbose_name='Название блюда'
     )
     image = models.ImageField(
-        upload_to='recipes/', verbose_name='Фотография блюда'
+        upload_to='recipes/', storage=ContentAddressedStorage(),
+        verbose_name='Фотография блюда'
+    )
+    image_variants = models.JSONField(
+        default=dict, blank=True, editable=False,
+        verbose_name='Уменьшенные копии фотографии'
     )
     text = models.TextField(
         max_length=MAX_LENGTH_TEXTFIELD,
@@ -131,9 +271,27 @@ class Recipe(models.Model):
         CustomUser, related_name='purchases',
         verbose_name='Список покупок'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В списках покупок'
+    )
+    relations_updated_at = models.DateTimeField(
+        default=timezone.now, editable=False, db_index=True,
+        verbose_name='Дата изменения избранного и списков покупок'
+    )
     pub_date = models.DateTimeField(
         auto_now_add=True, verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата изменения'
+    )
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name='Поисковый вектор'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -142,7 +300,25 @@ class Recipe(models.Model):
                 name='%(app_label)s_%(class)s_unique_recipe_name'
             )
         ]
-        ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-pub_date', 'id'), name='recipes_recipe_feed_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipes_recipe_author_idx'
+            ),
+            models.Index(
+                fields=('-favorites_count', '-in_carts_count', '-pub_date',
+                        'id'),
+                name='recipes_recipe_popular_idx'
+            ),
+            models.Index(
+                fields=('cooking_time', 'id'),
+                name='recipes_recipe_cooking_idx'
+            )
+        ]
+        ordering = ('-pub_date', 'id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -190,3 +366,196 @@ class QuantityOfIngredients(models.Model):
 
     def __str__(self):
         return f'{self.ingredient} - {self.amount}шт. для {self.recipe}'
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+    """Набор запросов для инкрементального обновления списков покупок."""
+
+    def apply_deltas(self, deltas):
+        """Применяет изменения количества ингредиентов к спискам покупок.
+
+        deltas: словарь вида {(user_id, ingredient_id): изменение amount}.
+        Строки с нулевым итоговым количеством удаляются.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        users = {user for user, _ in deltas}
+        with transaction.atomic():
+            # Блокируем юзеров, а не строки списка: новых строк ещё нет, и
+            # две транзакции иначе создали бы одну пару (user, ingredient).
+            CustomUser.objects.lock(users)
+            existing = {
+                (row.user_id, row.ingredient_id): row
+                for row in self.filter(
+                    user_id__in=users,
+                    ingredient_id__in={ingredient for _, ingredient in deltas}
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for (user, ingredient), delta in deltas.items():
+                row = existing.get((user, ingredient))
+                if row is None:
+                    if delta > 0:
+                        to_create.append(self.model(
+                            user_id=user, ingredient_id=ingredient,
+                            amount=delta
+                        ))
+                    continue
+                row.amount += delta
+                if row.amount > 0:
+                    to_update.append(row)
+                else:
+                    to_delete.append(row.pk)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ('amount',))
+            if to_delete:
+                self.filter(pk__in=to_delete).delete()
+
+    def add_purchases(self, pairs, sign=1):
+        """Добавляет(sign=1) или убирает(sign=-1) рецепты из списков покупок.
+
+        pairs: пары (user_id, recipe_id).
+        """
+        users_by_recipe = {}
+        for user, recipe in pairs:
+            users_by_recipe.setdefault(recipe, []).append(user)
+        deltas = {}
+        rows = QuantityOfIngredients.objects.filter(
+            recipe_id__in=users_by_recipe
+        ).values_list('recipe_id', 'ingredient_id', 'amount')
+        for recipe, ingredient, amount in rows:
+            for user in users_by_recipe[recipe]:
+                key = (user, ingredient)
+                deltas[key] = deltas.get(key, 0) + sign * amount
+        self.apply_deltas(deltas)
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок.
+
+        old_amounts, new_amounts: словари вида {ingredient_id: amount}.
+        """
+        changes = {
+            ingredient: (
+                new_amounts.get(ingredient, 0) - old_amounts.get(ingredient, 0)
+            )
+            for ingredient in {*old_amounts, *new_amounts}
+        }
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        users = recipe.purchase.values_list('id', flat=True)
+        self.apply_deltas({
+            (user, ingredient): delta
+            for user in users
+            for ingredient, delta in changes.items()
+        })
+
+    def live_totals(self, users=None):
+        """Суммы ингредиентов, посчитанные по рецептам в списках покупок.
+
+        Запрос строится от промежуточной таблицы «Recipe.purchase», чтобы
+        фильтр по юзерам не добавлял второе соединение с ней и не умножал
+        количества.
+        """
+        rows = Recipe.purchase.through.objects.filter(
+            recipe__ingredients__isnull=False
+        )
+        if users is not None:
+            rows = rows.filter(customuser_id__in=users)
+        return {
+            (row['customuser_id'], row['ingredient']): row['total']
+            for row in rows.values(
+                'customuser_id',
+                ingredient=models.F('recipe__ingredients__ingredient_id')
+            ).annotate(
+                total=models.Sum('recipe__ingredients__amount')
+            ).order_by()
+        }
+
+    def rebuild(self, users=None):
+        """Заново пересчитывает списки покупок(всех или выбранных юзеров)."""
+        totals = self.live_totals(users)
+        with transaction.atomic():
+            stale = self.all()
+            if users is not None:
+                stale = stale.filter(user__in=users)
+            stale.delete()
+            self.bulk_create(
+                self.model(user_id=user, ingredient_id=ingredient,
+                           amount=total)
+                for (user, ingredient), total in totals.items()
+            )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиентов в списке покупок юзера.
+
+    Материализованный агрегат по «Recipe.purchase» и «QuantityOfIngredients»,
+    обновляется инкрементально(см. «recipes.signals» и
+    «Helper.create_or_update_ingredients»).
+    Поля модели:
+      - user(1:M с моделью «CustomUser»): владелец списка покупок
+      - ingredient(1:M с моделью «Ingredient»): ингредиент
+      - amount: суммарное количество ингредиента
+    """
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients', verbose_name='Юзер'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE,
+        related_name='shopping_carts', verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Суммарное количество ингредиента'
+    )
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='%(app_label)s_%(class)s_unique_ingredient'
+            )
+        ]
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} для {self.user}'
+
+
+class RecipeSimilarity(models.Model):
+    """Похожий рецепт для рекомендаций(top-K на каждый рецепт).
+
+    Заполняется командой «build_recommendations» по косинусной близости
+    рецептов в избранном и списках покупок юзеров.
+    Поля модели:
+      - recipe(1:M с моделью «Recipe»): исходный рецепт
+      - similar(1:M с моделью «Recipe»): похожий рецепт
+      - score: косинусная близость рецептов
+    """
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='similarities', verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE,
+        related_name='recommended_by', verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Близость')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='%(app_label)s_%(class)s_unique_similar'
+            )
+        ]
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe}({self.score:.2f})'
@@ -0,0 +1,104 @@
+"""Рекомендации рецептов по избранному и спискам покупок юзеров.
+
+Каждый юзер - неявная оценка «нравится» для рецептов из своего избранного
+и корзины. Близость двух рецептов - косинус между множествами юзеров,
+которые их отметили:
+
+    score(a, b) = общих юзеров / sqrt(юзеров у a * юзеров у b)
+
+Матрица «юзер x рецепт» хранится разреженно: словари множеств id в обе
+стороны. Для каждого рецепта сохраняются только «top_k» самых похожих
+(модель «RecipeSimilarity»), поэтому пересчитать можно как все рецепты,
+так и только выбранные.
+"""
+import heapq
+from collections import Counter, defaultdict
+from math import sqrt
+from operator import itemgetter
+
+from django.db import transaction
+from foodgram.constants import (RECOMMENDATIONS_MAX_USER_RECIPES,
+                                RECOMMENDATIONS_TOP_K)
+
+from .models import Recipe, RecipeSimilarity
+
+
+class Interactions:
+    """Разреженная матрица «юзер x рецепт» из избранного и корзин."""
+    def __init__(self, pairs=()):
+        self.users = defaultdict(set)
+        self.recipes = defaultdict(set)
+        self._norms = None
+        for user, recipe in pairs:
+            self.users[user].add(recipe)
+            self.recipes[recipe].add(user)
+
+    def get_norms(self):
+        if self._norms is None:
+            self._norms = {
+                recipe: sqrt(len(users))
+                for recipe, users in self.recipes.items()
+            }
+        return self._norms
+
+    @classmethod
+    def load(cls):
+        interactions = cls()
+        for through in (Recipe.favorite.through, Recipe.purchase.through):
+            for user, recipe in through.objects.values_list(
+                'customuser_id', 'recipe_id'
+            ).iterator():
+                interactions.users[user].add(recipe)
+                interactions.recipes[recipe].add(user)
+        return interactions
+
+    def get_similar(self, recipe, top_k=RECOMMENDATIONS_TOP_K):
+        """Список (id рецепта, близость) для top_k похожих рецептов.
+
+        Юзеры с очень большим числом отметок не учитываются: они дают
+        квадратичное число пар и почти не несут сигнала.
+        """
+        users = self.recipes.get(recipe, ())
+        common = Counter()
+        for user in users:
+            recipes = self.users[user]
+            if len(recipes) <= RECOMMENDATIONS_MAX_USER_RECIPES:
+                common.update(recipes)
+        common.pop(recipe, None)
+        if not common:
+            return []
+        norms = self.get_norms()
+        norm = norms[recipe]
+        return heapq.nlargest(top_k, (
+            (other, count / (norm * norms[other]))
+            for other, count in common.items()
+        ), key=itemgetter(1))
+
+    def get_affected(self, users):
+        """Рецепты, близость которых зависит от отметок этих юзеров."""
+        return {
+            recipe for user in users for recipe in self.users.get(user, ())
+        }
+
+
+def build_similarities(interactions, recipes=None,
+                       top_k=RECOMMENDATIONS_TOP_K):
+    """Пересчитывает «RecipeSimilarity» для всех или выбранных рецептов.
+
+    Возвращает количество записанных строк.
+    """
+    if recipes is None:
+        stale = RecipeSimilarity.objects.all()
+        recipes = list(interactions.recipes)
+    else:
+        recipes = list(recipes)
+        stale = RecipeSimilarity.objects.filter(recipe_id__in=recipes)
+    rows = [
+        RecipeSimilarity(recipe_id=recipe, similar_id=similar, score=score)
+        for recipe in recipes
+        for similar, score in interactions.get_similar(recipe, top_k)
+    ]
+    with transaction.atomic():
+        stale.delete()
+        RecipeSimilarity.objects.bulk_create(rows, batch_size=5000)
+    return len(rows)
@@ -0,0 +1,252 @@
+"""Поиск по справочникам и рецептам приложения «recipes».
+
+Автодополнение ингредиентов ранжирует результаты: сначала названия,
+начинающиеся с запроса, затем названия, содержащие его. В PostgreSQL
+поиск идёт одним запросом по индексам на «lower(name)»(btree с
+«varchar_pattern_ops» для префиксов и GIN «pg_trgm» для подстрок),
+в остальных СУБД - по индексу префиксов в памяти процесса.
+
+Полнотекстовый поиск рецептов идёт по названию, описанию и названиям
+ингредиентов(с весами A, B и C). В PostgreSQL используется поле
+«Recipe.search_vector» с русской морфологией и GIN индексом, в остальных
+СУБД - инвертированный индекс в памяти процесса с упрощённым стеммингом.
+Индексы в памяти процесса согласуются между процессами общей версией
+(см. «versioning»).
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection, connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Lower
+
+from .models import Ingredient, QuantityOfIngredients, Recipe
+from .versioning import VersionedIndex
+
+POSTGRES_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingr_name_prefix_idx '
+    'ON recipes_ingredient (lower(name) varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingr_name_trgm_idx '
+    'ON recipes_ingredient USING gin (lower(name) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+SEARCH_CONFIG = 'russian'
+SEARCH_WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2}
+WORD_RE = re.compile(r'\w+')
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых',
+    'их', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ью', 'а', 'я', 'о',
+    'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+), key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def create_postgres_indexes(using='default', **kwargs):
+    """Создаёт индексы для поиска, которые нельзя описать в «Meta»."""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    with db.cursor() as cursor:
+        for sql in POSTGRES_INDEXES:
+            cursor.execute(sql)
+
+
+class IngredientPrefixIndex(VersionedIndex):
+    """Отсортированный по названию индекс ингредиентов в памяти процесса.
+
+    Загружается при первом поиске и сбрасывается сигналами при изменении
+    ингредиентов во всех процессах через общую версию.
+    """
+    version_key = 'search:ingredients:version'
+
+    def reset(self):
+        self._entries = None
+
+    def is_loaded(self):
+        return self._entries is not None
+
+    def load(self):
+        rows = sorted(
+            (name.lower(), pk) for pk, name in
+            Ingredient.objects.values_list('id', 'name').iterator()
+        )
+        self._entries = [name for name, _ in rows], [pk for _, pk in rows]
+
+    def search(self, query, limit):
+        """Список id ингредиентов: сначала префиксные совпадения."""
+        self.ensure_loaded()
+        names, ids = self._entries
+        found = []
+        position = bisect_left(names, query)
+        while (position < len(names) and len(found) < limit
+               and names[position].startswith(query)):
+            found.append(ids[position])
+            position += 1
+        for name, pk in zip(names, ids):
+            if len(found) >= limit:
+                break
+            if query in name and not name.startswith(query):
+                found.append(pk)
+        return found
+
+
+prefix_index = IngredientPrefixIndex()
+
+
+def search_ingredients(query, limit):
+    """Ингредиенты для автодополнения, не больше «limit» штук."""
+    query = query.strip().lower()
+    if not query:
+        return list(Ingredient.objects.order_by('name')[:limit])
+    if connection.vendor == 'postgresql':
+        return list(
+            Ingredient.objects.annotate(
+                name_lower=Lower('name')
+            ).filter(
+                name_lower__contains=query
+            ).annotate(
+                rank=Case(
+                    When(name_lower__startswith=query, then=Value(0)),
+                    default=Value(1), output_field=IntegerField()
+                )
+            ).order_by('rank', 'name_lower')[:limit]
+        )
+    ids = prefix_index.search(query, limit)
+    ingredients = Ingredient.objects.in_bulk(ids)
+    return [ingredients[pk] for pk in ids if pk in ingredients]
+
+
+def stem(word):
+    """Упрощённый стемминг: отбрасывает типичное окончание слова."""
+    word = word.lower().replace('ё', 'е')
+    for ending in ENDINGS:
+        if (word.endswith(ending)
+                and len(word) - len(ending) >= MIN_STEM_LENGTH):
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return {stem(word) for word in WORD_RE.findall(text)}
+
+
+class RecipeSearchIndex(VersionedIndex):
+    """Инвертированный индекс рецептов в памяти процесса(не PostgreSQL).
+
+    Основа слова -> {id рецепта: вес}. Загружается при первом поиске
+    двумя запросами и обновляется по одному рецепту после сохранения,
+    остальные процессы загружают его заново по общей версии.
+    """
+    version_key = 'search:recipes:version'
+
+    def reset(self):
+        self._postings = None
+        self._documents = {}
+
+    def is_loaded(self):
+        return self._postings is not None
+
+    def load(self):
+        self._postings = defaultdict(dict)
+        self._documents = {}
+        ingredients = defaultdict(list)
+        for recipe, name in QuantityOfIngredients.objects.values_list(
+            'recipe_id', 'ingredient__name'
+        ).iterator():
+            ingredients[recipe].append(name)
+        for pk, name, text in Recipe.objects.values_list(
+            'id', 'name', 'text'
+        ).iterator():
+            self._add(pk, name, text, ' '.join(ingredients[pk]))
+
+    def _add(self, pk, name, text, ingredients):
+        weights = {}
+        for value, weight in zip(
+            (ingredients, text, name), ('C', 'B', 'A')
+        ):
+            for token in tokenize(value):
+                weights[token] = SEARCH_WEIGHTS[weight]
+        self._documents[pk] = weights
+        for token, weight in weights.items():
+            self._postings[token][pk] = weight
+
+    def remove_local(self, pk):
+        for token in self._documents.pop(pk, ()):
+            self._postings[token].pop(pk, None)
+
+    def discard(self, pk):
+        if self._postings is not None:
+            self.remove_local(pk)
+        self.bump_version()
+
+    def update(self, pk, name, text, ingredients):
+        if self._postings is not None:
+            self.remove_local(pk)
+            self._add(pk, name, text, ingredients)
+        self.bump_version()
+
+    def search(self, query):
+        """Id рецептов, содержащих все слова запроса, по убыванию веса."""
+        self.ensure_loaded()
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        postings = sorted(
+            (self._postings.get(token, {}) for token in tokens), key=len
+        )
+        scores = {
+            pk: sum(posting[pk] for posting in postings)
+            for pk in postings[0]
+            if all(pk in posting for posting in postings[1:])
+        }
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))
+
+
+recipe_index = RecipeSearchIndex()
+
+
+def update_search_vector(recipe):
+    """Обновляет поисковые данные рецепта после сохранения состава."""
+    ingredients = ' '.join(
+        recipe.ingredient.order_by().values_list('name', flat=True)
+    )
+    if connection.vendor != 'postgresql':
+        transaction.on_commit(lambda: recipe_index.update(
+            recipe.pk, recipe.name, recipe.text, ingredients
+        ))
+        return
+    Recipe.objects.filter(pk=recipe.pk).update(
+        search_vector=(
+            SearchVector(Value(recipe.name), weight='A',
+                         config=SEARCH_CONFIG)
+            + SearchVector(Value(recipe.text), weight='B',
+                           config=SEARCH_CONFIG)
+            + SearchVector(Value(ingredients), weight='C',
+                           config=SEARCH_CONFIG)
+        )
+    )
+
+
+def search_recipes(queryset, query):
+    """Рецепты из «queryset», подходящие под запрос, по релевантности."""
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).filter(search_vector=search_query).order_by('-rank', 'id')
+    ids = recipe_index.search(query)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).order_by(Case(
+        *(When(id=pk, then=Value(position))
+          for position, pk in enumerate(ids)),
+        output_field=IntegerField()
+    ))
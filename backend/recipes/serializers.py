@@ -1,11 +1,17 @@
 from api.helpers import Helper
+from api.profiling import TimedFieldsMixin
+from api.relations import FAVORITES, PURCHASES, get_user_relations
 from django.db import transaction
-from drf_extra_fields.fields import Base64ImageField
 from recipes.models import Ingredient, QuantityOfIngredients, Recipe, Tag
 from rest_framework.serializers import (ModelSerializer, ReadOnlyField,
                                         SerializerMethodField, ValidationError)
 from users.serializers import CustomUserSerializer
 
+from .fields import Base64ImageField, ImageVariantField
+from .images import schedule_variants
+from .search import update_search_vector
+from .storage import has_content
+
 
 class TagSerializer(ModelSerializer):
     """Сериализатор для информации о тегах"""
@@ -36,9 +42,10 @@ class QuantityOfIngredientsSerializer(ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(ModelSerializer, Helper):
+class RecipeSerializer(TimedFieldsMixin, ModelSerializer, Helper):
     """Сериализатор для вывода информации о рецептах."""
     image = Base64ImageField()
+    image_webp = ImageVariantField(source='image', webp=True, read_only=True)
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
     author = CustomUserSerializer(read_only=True)
@@ -49,22 +56,30 @@ class RecipeSerializer(ModelSerializer, Helper):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_webp', 'text',
+            'cooking_time'
         )
 
     def get_is_favorited(self, obj):
-        """Метод проверяет находится ли рецепт в избранном."""
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        """Метод проверяет находится ли рецепт в избранном.
+
+        Использует аннотацию из «RecipeViewSet.get_queryset», если она есть.
+        """
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return user.favorites_recipes.filter(id=obj.id).exists()
+        return get_user_relations(request).has(FAVORITES, obj.id)
 
     def get_is_in_shopping_cart(self, obj):
         """Метод проверяет находится ли рецепт в списке покупок."""
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return user.purchases.filter(id=obj.id).exists()
+        return get_user_relations(request).has(PURCHASES, obj.id)
 
     def validate(self, data):
         """Проверяет данные, введённые юзером при создании/обновлении рецепта.
@@ -128,21 +143,32 @@ class RecipeSerializer(ModelSerializer, Helper):
         recipe = Recipe.objects.create(image=image, **validated_data)
         recipe.tag.set(tags_data)
         self.create_or_update_ingredients(recipe, ingredients_data)
+        update_search_vector(recipe)
+        image.close()
+        schedule_variants(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, recipe, validated_data):
         """Метод для обновления рецепта."""
-        recipe.image = validated_data.get('image', recipe.image)
+        image = validated_data.get('image')
+        if image and has_content(recipe.image, image.content_hash):
+            image.close()
+            image = None
+        if image:
+            recipe.image = image
+            recipe.image_variants = {}
         recipe.name = validated_data.get('name', recipe.name)
         recipe.text = validated_data.get('text', recipe.text)
         recipe.cooking_time = validated_data.get(
             'cooking_time', recipe.cooking_time
         )
-        recipe.tag.clear()
         recipe.tag.set(validated_data.pop('tags'))
-        QuantityOfIngredients.objects.filter(recipe=recipe).delete()
         ingredients_data = validated_data.pop('ingredients')
         self.create_or_update_ingredients(recipe, ingredients_data)
         recipe.save()
+        update_search_vector(recipe)
+        if image:
+            image.close()
+            schedule_variants(recipe)
         return recipe
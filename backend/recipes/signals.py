@@ -0,0 +1,150 @@
+"""Сигналы приложения «recipes».
+
+Поддерживают в актуальном состоянии материализованные списки покупок
+(модель «ShoppingCartIngredient») при изменении «Recipe.purchase»,
+отметку «CustomUser.relations_updated_at» и счётчики «favorites_count»/
+«in_carts_count» рецептов при изменении избранного и корзины, а так же
+сбрасывают индексы автодополнения, поиска и подбора рецептов при
+изменении ингредиентов и удалении рецептов.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from users.models import CustomUser
+
+from .matching import ingredient_index
+from .models import Ingredient, Recipe, ShoppingCartIngredient
+from .search import prefix_index, recipe_index
+
+
+def get_pairs(instance, reverse, pk_set):
+    """Пары (user_id, recipe_id) для сигнала «m2m_changed»."""
+    if reverse:
+        return [(instance.pk, recipe) for recipe in pk_set]
+    return [(user, instance.pk) for user in pk_set]
+
+
+def get_removed_rows(sender, instance, action, reverse, pk_set):
+    """Удаляемые строки промежуточной таблицы под блокировкой юзеров.
+
+    Юзеры блокируются до чтения строк: иначе два одновременных удаления
+    одной связи прочитали бы одну и ту же строку и оба вычли бы её из
+    производных данных. Django отправляет «pre_remove»/«pre_clear» внутри
+    транзакции, поэтому блокировка держится до удаления строк.
+    """
+    rows = sender.objects.filter(
+        **{'customuser' if reverse else 'recipe': instance}
+    )
+    if action == 'pre_remove':
+        other = 'recipe_id__in' if reverse else 'customuser_id__in'
+        rows = rows.filter(**{other: pk_set})
+    if reverse:
+        users = [instance.pk]
+    elif action == 'pre_remove':
+        users = pk_set
+    else:
+        users = rows.values('customuser_id')
+    CustomUser.objects.lock(users)
+    return rows
+
+
+@receiver(m2m_changed, sender=Recipe.purchase.through)
+def purchase_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Добавление/удаление рецептов из списков покупок.
+
+    При добавлении «pk_set» содержит только вставляемые строки: повторная
+    вставка той же связи параллельным запросом нарушит уникальность
+    промежуточной таблицы до «post_add», и её изменение откатится.
+    """
+    if action == 'post_add':
+        ShoppingCartIngredient.objects.add_purchases(
+            get_pairs(instance, reverse, pk_set)
+        )
+    elif action in ('pre_remove', 'pre_clear'):
+        rows = get_removed_rows(sender, instance, action, reverse, pk_set)
+        ShoppingCartIngredient.objects.add_purchases(
+            rows.values_list('customuser_id', 'recipe_id'), sign=-1
+        )
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.purchase.through)
+def relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Отметка об изменении избранного/корзины для ETag списков рецептов."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        users = [instance.pk]
+    elif action == 'pre_clear':
+        users = sender.objects.filter(
+            recipe=instance
+        ).values_list('customuser', flat=True)
+    else:
+        users = pk_set
+    CustomUser.objects.touch_relations(users)
+
+
+@receiver(m2m_changed, sender=Recipe.favorite.through)
+@receiver(m2m_changed, sender=Recipe.purchase.through)
+def counters_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Атомарное обновление счётчиков избранного/корзины у рецептов.
+
+    При добавлении Django передаёт в «pk_set» только новые связи, а при
+    удалении - все переданные id, поэтому удаляемые строки берутся из БД
+    под блокировкой юзеров(см. «get_removed_rows»).
+    """
+    field = (
+        'favorites_count' if sender is Recipe.favorite.through
+        else 'in_carts_count'
+    )
+    if action == 'post_add':
+        recipes = pk_set if reverse else [instance.pk] * len(pk_set)
+        sign = 1
+    elif action in ('pre_remove', 'pre_clear'):
+        rows = get_removed_rows(sender, instance, action, reverse, pk_set)
+        recipes = rows.values_list('recipe_id', flat=True)
+        sign = -1
+    else:
+        return
+    Recipe.objects.change_counter(field, {
+        recipe: sign * count for recipe, count in Counter(recipes).items()
+    })
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Удаление рецепта из списков покупок при удалении самого рецепта."""
+    ShoppingCartIngredient.objects.add_purchases(
+        [(user, instance.pk)
+         for user in instance.purchase.values_list('id', flat=True)],
+        sign=-1
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    """Удаление рецепта из индексов поиска и подбора по ингредиентам.
+
+    Индексы меняются после фиксации транзакции: иначе другой процесс
+    мог бы увидеть новую версию индекса и загрузить ещё старые данные.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: recipe_index.discard(pk))
+    ingredient_index.discard_on_commit(pk)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    """Сброс индексов автодополнения ингредиентов и поиска рецептов."""
+    transaction.on_commit(prefix_index.invalidate)
+    transaction.on_commit(recipe_index.invalidate)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, **kwargs):
+    """Сброс индекса подбора: ингредиент удалён из всех рецептов."""
+    transaction.on_commit(ingredient_index.invalidate)
@@ -0,0 +1,53 @@
+"""Контентно-адресуемое хранилище для фотографий рецептов.
+
+Файл называется по sha256 своего содержимого(«recipes/ab/abcd….jpg»),
+поэтому одинаковые фотографии хранятся один раз, а содержимое по одному
+адресу никогда не меняется и его можно кешировать навсегда. Счётчик
+ссылок на файл - это количество рецептов, которые на него ссылаются;
+файлы без ссылок удаляет команда «collect_media».
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def get_content_hash(content):
+    """sha256 содержимого файла(берётся готовый, если поле его посчитало)."""
+    content_hash = getattr(content, 'content_hash', None)
+    if content_hash:
+        return content_hash
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def has_content(field_file, content_hash):
+    """Проверяет, что в поле уже лежит файл с таким содержимым."""
+    stem = os.path.splitext(os.path.basename(field_file.name or ''))[0]
+    return stem == content_hash
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        content_hash = get_content_hash(content)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(
+            directory, content_hash[:2], f'{content_hash}{extension}'
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            return super().save(name, content, max_length)
+        name = self.get_hashed_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
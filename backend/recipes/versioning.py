@@ -0,0 +1,66 @@
+"""Общая версия индексов, которые хранятся в памяти процесса.
+
+Версия индекса лежит в общем кеше Django. Процесс, изменивший данные,
+обновляет свой индекс на месте(или сбрасывает его) и увеличивает версию
+через «cache.incr», остальные процессы видят новую версию и загружают
+индекс заново при следующем обращении.
+"""
+import random
+
+from django.core.cache import cache
+
+
+class VersionedIndex:
+    """Базовый класс индекса с общей версией.
+
+    Наследники задают «version_key», а так же методы «reset»(очистить
+    данные процесса), «is_loaded» и «load».
+    """
+    version_key = None
+
+    def __init__(self):
+        self._version = None
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def is_loaded(self):
+        raise NotImplementedError
+
+    def load(self):
+        raise NotImplementedError
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, random.getrandbits(32), None)
+            return cache.get(self.version_key)
+        return version
+
+    def bump_version(self):
+        """Увеличивает общую версию после изменения индекса.
+
+        Индекс процесса остаётся актуальным, только если с момента его
+        загрузки версию не менял никто другой, иначе он будет загружен
+        заново.
+        """
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError:
+            version = None
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self.reset()
+
+    def invalidate(self):
+        self.reset()
+        self.bump_version()
+
+    def ensure_loaded(self):
+        """Загружает индекс, если его нет или версия устарела."""
+        version = self.get_version()
+        if not self.is_loaded() or self._version != version:
+            self.load()
+            self._version = version
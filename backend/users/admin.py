@@ -1,5 +1,7 @@
 from django.contrib.admin import register
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 from .models import CustomUser
 
@@ -28,11 +30,25 @@ class CustomUserAdmin(UserAdmin):
     ordering = ('username',)
     empty_value_display = '-пусто-'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            sub=Coalesce(
+                Subquery(
+                    CustomUser.subscriber.through.objects.filter(
+                        from_customuser=OuterRef('pk')
+                    ).order_by().values('from_customuser')
+                    .annotate(cnt=Count('pk')).values('cnt'),
+                    output_field=IntegerField()
+                ), 0
+            )
+        )
+
     def full_name_user(self, obj):
         full_name = '%s %s' % (obj.first_name, obj.last_name)
         return full_name.strip()
     full_name_user.short_description = 'Имя пользователя'
 
     def sub(self, obj):
-        return obj.subscriber.count()
+        return obj.sub
     sub.short_description = 'В подписках'
+    sub.admin_order_field = 'sub'
@@ -1,8 +1,59 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.dispatch import Signal
+from django.utils import timezone
 from foodgram.constants import (MAX_LENGTH_CHARFIELD, MAX_LENGTH_EMAILFIELD,
                                 MAX_LENGTH_ROLE_USER)
 
+# Отправляется после изменения отметки «relations_updated_at»(user_ids).
+relations_touched = Signal()
+
+
+class CustomUserQuerySet(models.QuerySet):
+    """Набор запросов для модели «CustomUser»."""
+
+    def with_is_subscribed(self, user):
+        """Аннотирует юзеров флагом «is_subscribed» для пользователя «user»."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.annotate(
+            is_subscribed=models.Exists(
+                CustomUser.subscriber.through.objects.filter(
+                    from_customuser=models.OuterRef('pk'),
+                    to_customuser=user
+                )
+            )
+        )
+
+    def lock(self, user_ids):
+        """Блокирует строки юзеров до конца текущей транзакции.
+
+        Сериализует изменения избранного, корзины и производных от них
+        данных(списков покупок, счётчиков) одного юзера. Строки
+        блокируются в порядке id, чтобы транзакции не ждали друг друга
+        по кругу. Вызывается внутри «transaction.atomic».
+        """
+        list(
+            self.select_for_update().filter(pk__in=user_ids)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def touch_relations(self, user_ids):
+        """Отмечает изменение избранного, корзины или подписок юзеров."""
+        user_ids = list(user_ids)
+        self.filter(pk__in=user_ids).update(
+            relations_updated_at=timezone.now()
+        )
+        relations_touched.send(sender=CustomUser, user_ids=user_ids)
+
+
+class CustomUserManager(UserManager.from_queryset(CustomUserQuerySet)):
+    """Менеджер юзеров с методами «CustomUserQuerySet»."""
+
 
 class CustomUser(AbstractUser):
     """Кастомная модель юзеров, которая основана на модели «AbstractUser».
@@ -14,6 +65,8 @@ class CustomUser(AbstractUser):
       - first_name: имя пользователя.
       - last_name: фамилия пользователя.
       - subscriber(M2M на одной модели): подписки пользователя на других юзеров
+      - relations_updated_at: дата последнего изменения избранного, списка
+                              покупок или подписок(используется для ETag)
     """
     USER = 'user'
     ADMIN = 'admin'
@@ -44,6 +97,12 @@ class CustomUser(AbstractUser):
         to='self', symmetrical=False,
         related_name='subscribers', verbose_name='Подписки юзера'
     )
+    relations_updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата изменения избранного, покупок и подписок'
+    )
+
+    objects = CustomUserManager()
 
     @property
     def is_admin(self):
@@ -1,4 +1,7 @@
+from api.profiling import TimedFieldsMixin
+from api.relations import SUBSCRIPTIONS, get_user_relations
 from djoser.serializers import UserCreateSerializer, UserSerializer
+from recipes.fields import ImageVariantField
 from recipes.models import Recipe
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
@@ -14,7 +17,7 @@ class CustomUserRegistrationSerializer(UserCreateSerializer):
                   'first_name', 'last_name', 'password')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedFieldsMixin, UserSerializer):
     """Сериализатор для вывода информации о пользователях."""
     is_subscribed = SerializerMethodField()
 
@@ -25,30 +28,45 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         """Метод проверяет, находится ли пользователь в подписках."""
-        user = self.context.get('request').user
-        if user.is_anonymous or user == obj:
+        request = self.context.get('request')
+        if request.user.is_anonymous or request.user == obj:
             return False
-        return user.subscribers.filter(id=obj.id).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return get_user_relations(request).has(SUBSCRIPTIONS, obj.id)
 
 
-class FavoriteAndPurchaseSerializer(ModelSerializer):
+class FavoriteAndPurchaseSerializer(TimedFieldsMixin, ModelSerializer):
     """Укороченный сериализатор рецепта.
 
     Для вывода информации о рецепте, при его добавлении в избранное или
     в список покупок. А так же для вывода информации о рецептах пользователя
     при подписке на него.
     """
+    image = ImageVariantField(variant='list', read_only=True)
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class SubscribeSerializer(UserSerializer):
-    """Сериализатор для информации о юзерах на которых оформлена подписка."""
+def get_recipes_limit(request):
+    """Значение параметра «recipes_limit» или None, если он не задан."""
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+class SubscribeSerializer(TimedFieldsMixin, UserSerializer):
+    """Сериализатор для информации о юзерах на которых оформлена подписка.
+
+    Количество рецептов в выдаче ограничивается параметром «recipes_limit».
+    """
     is_subscribed = SerializerMethodField()
     recipes_count = SerializerMethodField()
-    recipes = FavoriteAndPurchaseSerializer(many=True, read_only=True)
+    recipes = SerializerMethodField()
 
     class Meta:
         model = CustomUser
@@ -58,6 +76,23 @@ class SubscribeSerializer(UserSerializer):
     def get_is_subscribed(self, obj):
         return True
 
+    def get_recipes(self, obj):
+        """Последние рецепты пользователя.
+
+        Берутся из «latest_recipes»(Prefetch во вьюсете), если он есть.
+        """
+        recipes = getattr(obj, 'latest_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit:
+                recipes = recipes[:limit]
+        return FavoriteAndPurchaseSerializer(
+            recipes, many=True, context=self.context
+        ).data
+
     def get_recipes_count(self, obj):
         """Метод считает количество рецептов пользователя."""
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
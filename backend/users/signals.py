@@ -0,0 +1,26 @@
+"""Сигналы приложения «users».
+
+Поддерживают отметку «CustomUser.relations_updated_at» при изменении
+подписок, чтобы ETag ответов с флагом «is_subscribed» менялся.
+"""
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import CustomUser
+
+
+@receiver(m2m_changed, sender=CustomUser.subscriber.through)
+def subscriptions_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Отмечает изменение подписок у подписчика."""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        users = [instance.pk]
+    elif action == 'pre_clear':
+        users = sender.objects.filter(
+            from_customuser=instance
+        ).values_list('to_customuser', flat=True)
+    else:
+        users = pk_set
+    CustomUser.objects.touch_relations(users)